@@ -2,105 +2,140 @@
 #include <stdio.h>
 #include <stdlib.h>
 
-typedef struct ResultStruct{
-    char** found_array;
+typedef struct TrieNodeStruct{
+    unsigned char key;
+    int value;
+    int child;
+    int sibling;
+}TrieNode;
+
+typedef struct TrieStruct{
+    TrieNode* nodes;
     int size;
-}Result;
+    int capacity;
+}Trie;
+
+int trie_child(Trie*, int, unsigned char);
+int trie_new_node(Trie*, unsigned char);
+int walk_prefix(Trie*, const char*, int*, int);
 
-char** append(char**, size_t*, const char*);
-int search(char**, char[], int);
-char* reverse(char*);
-Result* compile_result(char** array, int size);
+Trie* create_trie(void){
+    // Creates an empty byte trie, words are added one by one with trie_insert
+    Trie* trie = malloc(sizeof(Trie));
+    trie->size = 0;
+    trie->capacity = 64;
+    trie->nodes = malloc(sizeof(TrieNode) * trie->capacity);
+    // Node 0 is the root, it never counts as a match since an empty prefix matches everything
+    trie_new_node(trie, '\0');
+    return trie;
+}
 
-Result* find_commands(char** commands, char* string, int n){
-    // Returns 2D char array of commands that it found from given string
-    size_t found = 1;
-    char** found_cmd = calloc(sizeof(char*), found);
-    // Remember stella, this iterate each word it founds.
-    char* word = strtok(string, " ");
-    while(word != NULL) {
-        char* target = reverse(word);
-        int view = strlen(word);
-        while (view > 0){
-            char temporary = target[view];
-            target[view] = '\0';
-            int index = search(commands, target, n);
-            if (index != -1){
-                char* command = reverse(commands[index]);
-                found_cmd = append(found_cmd, &found, command);
-                free(command);
-            }
-            target[view] = temporary;
-            view--;
+int find_commands(Trie* trie, const char* string, int* found, int size){
+    // Writes the value of every command that a word in string ends with into found, the trie holds every command
+    // reversed. Returns the amount of commands written, found is never written past size.
+    int amount = 0;
+    int end = 0;
+    while (string[end] != '\0'){
+        // Remember stella, this iterate each word it founds.
+        int start = end;
+        while (string[end] != '\0' && string[end] != ' ')
+            end++;
+        // Walking the word backward through the reversed commands finds every command the word ends with
+        int node = 0;
+        for(int i = end - 1; i >= start && amount < size; i--){
+            node = trie_child(trie, node, (unsigned char)string[i]);
+            if (node == -1)
+                break;
+            if (trie->nodes[node].value != -1)
+                found[amount++] = trie->nodes[node].value;
         }
-        free(target);
-        word = strtok(NULL, " ");
+        while (string[end] == ' ')
+            end++;
     }
-    return compile_result(found_cmd, found);
+    return amount;
+}
+
+int find_prefix(Trie* trie, const char* content, int* found, int size){
+    // Walks content from the start once, the value of every terminal node passed is written into found.
+    // Returns the amount of prefixes written, found is never written past size.
+    return walk_prefix(trie, content, found, size);
 }
 
-Result* compile_result(char** array, int size){
-    // Creates a struct pointer to return to Python
-    Result* pointer_result = malloc(sizeof(Result));
-    Result result = {array, size - 1};
-    *pointer_result = result;
-    return pointer_result;
+int find_prefix_many(Trie* trie, const char** contents, int n, int* counts, int* found, int size){
+    // Same as find_prefix for many contents in one call, counts[i] is the amount of prefixes found for contents[i]
+    int amount = 0;
+    for(int i = 0; i < n; i++){
+        counts[i] = walk_prefix(trie, contents[i], found + amount, size - amount);
+        amount += counts[i];
+    }
+    return amount;
 }
 
-Result* multi_find_prefix(char** prefixes, char content[], int n){
-    // Creates a 2D char array of prefixes it found from content
-    int start = strlen(content);
-    size_t found = 1;
-    char** found_prefixes = calloc(sizeof(char*), found);
-    while(start > 0){
-        int result = search(prefixes, content, n);
-        if (result != -1)
-            found_prefixes = append(found_prefixes, &found, content);
-        content[start-=1] = '\0';
+int walk_prefix(Trie* trie, const char* content, int* found, int size){
+    // Writes the value of every known prefix of content into found
+    int amount = 0;
+    int node = 0;
+    for(int i = 0; content[i] != '\0' && amount < size; i++){
+        node = trie_child(trie, node, (unsigned char)content[i]);
+        if (node == -1)
+            break;
+        if (trie->nodes[node].value != -1)
+            found[amount++] = trie->nodes[node].value;
     }
-    return compile_result(found_prefixes, found);
+    return amount;
 }
 
-char** append(char** arr, size_t* size, const char* target){
-    // Append new char array into a 2D char array
-    arr[*size - 1] = strdup(target);
-    return realloc(arr, (*size+=1) * sizeof(char*));
+void trie_remove(Trie* trie, const char* word){
+    // Unmarks the word, the nodes are kept since they are likely to be reused and are cheap to walk through
+    int node = 0;
+    for(int i = 0; word[i] != '\0' && node != -1; i++)
+        node = trie_child(trie, node, (unsigned char)word[i]);
+    if (node > 0)
+        trie->nodes[node].value = -1;
 }
 
-int search(char** arr, char target[], int n){
-    // Binary search for 2D array and return the index of target, -1 if it can't find it
-    int low = 0;
-    int high = n - 1;
-    while (high >= low) {
-        int mid = low + (high - low) / 2;
-        int result = strcmp(arr[mid], target);
-        if(result == 0)
-            return mid;
-        if(result > 0)
-            high = mid - 1;
-        else if(result < 0)
-            low = mid + 1;
+void trie_insert(Trie* trie, const char* word, int value){
+    // Inserts a word into the trie, creating nodes for any byte that has not been seen at that depth.
+    // The value is what gets reported back when the word is matched.
+    int node = 0;
+    for(int i = 0; word[i] != '\0'; i++){
+        unsigned char key = (unsigned char)word[i];
+        int next = trie_child(trie, node, key);
+        if (next == -1){
+            next = trie_new_node(trie, key);
+            trie->nodes[next].sibling = trie->nodes[node].child;
+            trie->nodes[node].child = next;
+        }
+        node = next;
     }
-    return -1;
+    if (node != 0)
+        trie->nodes[node].value = value;
 }
 
-void free_result(Result* pointer_result){
-    // Free the allocated memory of Result pointer
-    int size = (*pointer_result).size;
-    // Due to strdup stored in the array, it is required to free from the heap for each element
-    for(int i = size - 1; i >= 0; i--)
-        free((*pointer_result).found_array[i]);
-    // Now we can release the array
-    free((*pointer_result).found_array);
-    free(pointer_result);
+int trie_child(Trie* trie, int node, unsigned char key){
+    // Linear scan through the siblings, a node rarely has more than a handful of children
+    int child = trie->nodes[node].child;
+    while (child != -1){
+        if (trie->nodes[child].key == key)
+            return child;
+        child = trie->nodes[child].sibling;
+    }
+    return -1;
 }
 
-char* reverse(char* word){
-    // Reverse an array of character.
-    int n = strlen(word);
-    char* reverse_word = strdup(word);
-    for(int i = 0; i < n; i++){
-        reverse_word[i] = word[(n - 1) - i];
+int trie_new_node(Trie* trie, unsigned char key){
+    // Allocates a node from the pool, growing it when full. Returns the index of the node
+    if (trie->size == trie->capacity){
+        trie->capacity *= 2;
+        trie->nodes = realloc(trie->nodes, sizeof(TrieNode) * trie->capacity);
     }
-    return reverse_word;
-}
\ No newline at end of file
+    TrieNode node = {key, -1, -1, -1};
+    trie->nodes[trie->size] = node;
+    return trie->size++;
+}
+
+void free_trie(Trie* trie){
+    // Release the node pool and the trie itself
+    free(trie->nodes);
+    free(trie);
+}
@@ -4,7 +4,6 @@ import asyncio
 import base64
 import collections
 import contextlib
-import ctypes
 import datetime
 import functools
 import io
@@ -16,8 +15,8 @@ import textwrap
 import time
 
 from dataclasses import dataclass
-from typing import (TYPE_CHECKING, Any, AsyncGenerator, Callable, Coroutine, Dict, List, Optional, Tuple, Type, TypeVar,
-                    Union)
+from typing import (TYPE_CHECKING, Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Type,
+                    TypeVar, Union)
 
 import discord
 
@@ -26,23 +25,66 @@ from discord import ui
 from discord.ext import commands, menus
 from discord.ext.commands import UserNotFound
 from discord.ext.menus import ListPageSource
+from discord.utils import maybe_coroutine
 from fuzzywuzzy import fuzz
 
 from utils import flags as flg, greedy_parser
+from utils.buffered_writer import BufferedWriter
 from utils.buttons import InteractionPages, PromptView
-from utils.decorators import event_check, is_discordpy, listen_for_guilds, pages, wait_ready
+from utils.cache import LRUCache
+from utils.decorators import event_check, is_discordpy, pages, wait_ready
 from utils.errors import BotNotFound, ErrorNoSignature, NotInDatabase
-from utils.image_manipulation import create_bar, get_majority_color, islight, process_image
+from utils.image_manipulation import chart_cache, chart_key, create_bar, fetch_avatar, process_image
 from utils.new_converters import BotCommands, BotPrefixes, IsBot
-from utils.useful import (StellaContext, StellaEmbed, aware_utc, compile_array, default_date, plural, print_exception,
-                          realign, search_commands, search_prefixes, try_call)
+from utils.useful import (CompiledTrie, PrefixSearchBatch, StellaContext, StellaEmbed, aware_utc, default_date, plural,
+                          print_exception, realign, search_commands, search_prefixes, try_call)
 
 if TYPE_CHECKING:
     from main import StellaBot
 
 ReactRespond = collections.namedtuple("ReactRespond", "created_at author reference")
 DISCORD_PY = 336642139381301249
+# channels where ?addbot is used in discord.py
+ADDBOT_CHANNELS = frozenset((559455534965850142, 381963689470984203, 381963705686032394))
+# at most this many fetch_user requests are in flight at once, per cog
+USER_FETCH_LIMIT = 5
 T = TypeVar("T")
+# a message ending with one of these right after at most 30 characters is a command any bot is likely to answer,
+# the named group that matched is the command
+PREFIX_TRIGGER = re.compile(r"^(?P<prefix>.{1,30}?)(?:(?P<jsk>jsk)|(?P<help>help)|(?P<ping>ping))$", re.I)
+
+
+def embed_text(embed: discord.Embed) -> str:
+    """Every text an embed shows joined by newlines."""
+    texts = [embed.title, embed.description, embed.author.name, embed.footer.text]
+    texts.extend(text for field in embed.fields for text in (field.name, field.value))
+    return "\n".join(filter(None, texts))
+
+
+def message_text_search(*text_list: str) -> Callable[[discord.Message], bool]:
+    """Check for a message that has any of text_list in its content or embeds, ignoring cases."""
+    terms = [t.casefold() for t in text_list]
+
+    def check(m: discord.Message) -> bool:
+        for text in itertools.chain((m.content,), map(embed_text, m.embeds)):
+            folded = text.casefold()
+            if any(t in folded for t in terms):
+                return True
+        return False
+    return check
+
+
+def check_jsk(m: discord.Message) -> bool:
+    possible_text = ("Jishaku", "discord.py", "Python ", "Module ", "guild(s)", "user(s).")
+    return all(text in m.content for text in possible_text)
+
+
+# what a response to each PREFIX_TRIGGER command looks like
+TRIGGER_CHECKS: Dict[str, Callable[[discord.Message], bool]] = {
+    "jsk": check_jsk,
+    "help": message_text_search("command", "help", "category", "categories"),
+    "ping": message_text_search("ping", "ms", "pong", "latency", "websocket", "bot", "database"),
+}
 
 
 class DeletedUser:
@@ -67,6 +109,65 @@ class DeletedUser:
         return f"<{type(self).__name__} id={self.id}>"
 
 
+Responded = Union[discord.Message, ReactRespond]
+
+
+class ResponseWindow:
+    """Responses to a message collected while the window is open. Bots that respond before any user does are in bots,
+       bots that reply to the message after a user has spoken are in after_user."""
+
+    __slots__ = ("message", "check", "bots", "after_user", "flip")
+
+    def __init__(self, message: discord.Message, check: Optional[Callable[[discord.Message], bool]] = None):
+        self.message = message
+        self.check = check
+        self.bots: Dict[int, Responded] = {}
+        self.after_user: Dict[int, Responded] = {}
+        self.flip = False
+
+    def feed(self, responded: Responded) -> None:
+        author = responded.author
+        if author.id in self.bots or author.id in self.after_user:
+            return
+        if not author.bot:
+            self.flip = True
+        elif not self.flip:
+            self.bots[author.id] = responded
+        elif getattr(responded.reference, "cached_message", None) == self.message:
+            self.after_user[author.id] = responded
+
+
+class ResponseRouter:
+    """Hands every message and reaction to the windows opened in its channel, so an event only visits the few windows
+       it can belong to instead of every pending wait_for in the bot."""
+
+    def __init__(self) -> None:
+        self._channels: Dict[int, List[ResponseWindow]] = {}
+
+    def open(self, message: discord.Message,
+             check: Optional[Callable[[discord.Message], bool]] = None) -> ResponseWindow:
+        window = ResponseWindow(message, check)
+        self._channels.setdefault(message.channel.id, []).append(window)
+        return window
+
+    def close(self, window: ResponseWindow) -> None:
+        channel_id = window.message.channel.id
+        windows = self._channels[channel_id]
+        windows.remove(window)
+        if not windows:
+            del self._channels[channel_id]
+
+    def route_message(self, message: discord.Message) -> None:
+        for window in self._channels.get(message.channel.id, ()):
+            if window.check is None or window.check(message):
+                window.feed(message)
+
+    def route_reaction(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]) -> None:
+        for window in self._channels.get(reaction.message.channel.id, ()):
+            if reaction.message.id == window.message.id:
+                window.feed(ReactRespond(datetime.datetime.utcnow(), user, None))
+
+
 class NoPendingBots(ErrorNoSignature):
     def __init__(self) -> None:
         super().__init__("```\nThere are no pending bots at the moment.```")
@@ -122,7 +223,7 @@ class BotPredictPrefixes:
         if not (data := await ctx.bot.pool_pg.fetch(query, user.id)):
             raise NotInDatabase(user)
         NN = ctx.bot.derivative_prefix_neural
-        prefix, raw_data = await NN.predict(data, return_raw=True)
+        prefix, raw_data = NN.predict(data, return_raw=True)
         instance = cls(user, prefix, raw_data)
         if not instance.prefix:
             raise commands.CommandError(
@@ -324,18 +425,6 @@ async def bot_pending_list(_, menu: Any, entry: Dict[str, Union[datetime.datetim
 deco_event = Callable[[Callable], Callable]
 
 
-def is_user() -> deco_event:
-    """Event check for returning true if it's a bot."""
-    return event_check(lambda _, m: not m.author.bot)
-
-
-def prefix_cache_ready() -> deco_event:
-    """Event check for command_count"""
-    def predicate(self, message: discord.Message) -> bool:
-        return self.compiled_prefixes and self.compiled_commands and not message.author.bot
-    return event_check(predicate)
-
-
 def dpy_bot() -> deco_event:
     """Event check for dpy_bots"""
     return event_check(lambda _, member: member.bot and member.guild.id == DISCORD_PY)
@@ -352,32 +441,63 @@ class FindBot(commands.Cog, name="Bots"):
         self.re_addbot = re_command + re_bot + re_reason
         self.re_github = re.compile(r'https?://(?:www\.)?github.com/(?P<repo_owner>(\w|-)+)/(?P<repo_name>(\w|-)+)?')
         self.cached_bots = {}
-        self.compiled_prefixes = None
-        self.compiled_commands = None
+        self.compiled_prefixes = CompiledTrie()
+        self.compiled_commands = CompiledTrie(reverse=True)
+        # an empty trie is falsy, so whether the tries were filled is tracked separately
+        self.tries_loaded = False
+        self.prefix_search_batch = PrefixSearchBatch() if bot.batch_search else None
         self.all_bot_prefixes = {}
         self.all_bot_commands = {}
+        self.writer = BufferedWriter(bot)
+        self.writer.start()
+        self._handler_tasks: Set[asyncio.Task[None]] = set()
+        self.response_router = ResponseRouter()
+        # last message sent by a user in each channel, this is what a bot message without a reply is responding to
+        self.last_human_messages: LRUCache[int, discord.Message] = LRUCache(maxsize=2048)
+        # certainty of (bot_id, repo_owner, repo_name), and the highest certainty of each bot that bot_repo holds
+        self.repo_certainties: LRUCache[Tuple[int, str, str], int] = LRUCache(maxsize=4096, ttl=3600)
+        self.stored_repo_certainty: LRUCache[int, int] = LRUCache(maxsize=4096)
+        # users that are not in the guild, fetched from discord
+        self.fetched_users: LRUCache[int, discord.User] = LRUCache(maxsize=1024, ttl=3600)
+        self._user_fetches = asyncio.Semaphore(USER_FETCH_LIMIT)
         bot.loop.create_task(self.loading_all_prefixes())
         bot.loop.create_task(self.task_handler())
 
+    async def cog_unload(self) -> None:
+        await self.writer.close()
+
     async def loading_all_prefixes(self) -> None:
         """Loads all unique prefix when it loads and set compiled_pref for C code."""
         await self.bot.wait_until_ready()
         prefix_data = await self.bot.pool_pg.fetch("SELECT DISTINCT bot_id, prefix FROM prefixes_list")
         commands_data = await self.bot.pool_pg.fetch("SELECT DISTINCT bot_id, command FROM commands_list")
         for prefix, command in itertools.zip_longest(prefix_data, commands_data):
-            if prefix:
-                prefix_list = self.all_bot_prefixes.setdefault(prefix["bot_id"], set())
-                prefix_list.add(prefix["prefix"])
+            if prefix and prefix["prefix"] is not None:
+                self.add_bot_prefix(prefix["bot_id"], prefix["prefix"])
             if command:
-                command_list = self.all_bot_commands.setdefault(command["bot_id"], set())
-                command_list.add(command["command"])
-        self.update_compile()
+                self.add_bot_command(command["bot_id"], command["command"])
+        self.tries_loaded = True
 
-    def update_compile(self) -> None:
-        temp = [*{prefix for prefix_list in self.all_bot_prefixes.values() for prefix in prefix_list}]
-        cmds = [*{command for command_list in self.all_bot_commands.values() for command in command_list}]
-        self.compiled_prefixes = compile_array(sorted(temp))
-        self.compiled_commands = compile_array(sorted(x[::-1] for x in cmds))
+    def add_bot_prefix(self, bot_id: int, prefix: str) -> None:
+        """Remembers a prefix of a bot, the C trie is only touched when it's a prefix no bot had before."""
+        prefix_list = self.all_bot_prefixes.setdefault(bot_id, set())
+        if prefix not in prefix_list:
+            prefix_list.add(prefix)
+            self.compiled_prefixes.add(prefix)
+
+    def remove_bot_prefix(self, bot_id: int, prefix: str) -> None:
+        """Forgets a prefix of a bot, the C trie is only touched when no other bot has this prefix."""
+        prefix_list = self.all_bot_prefixes.get(bot_id, set())
+        if prefix in prefix_list:
+            prefix_list.remove(prefix)
+            self.compiled_prefixes.discard(prefix)
+
+    def add_bot_command(self, bot_id: int, command: str) -> None:
+        """Remembers a command of a bot, the C trie is only touched when it's a command no bot had before."""
+        command_list = self.all_bot_commands.setdefault(bot_id, set())
+        if command not in command_list:
+            command_list.add(command)
+            self.compiled_commands.add(command)
 
     @commands.Cog.listener("on_member_join")
     @wait_ready()
@@ -391,48 +511,19 @@ class FindBot(commands.Cog, name="Bots"):
         else:
             await self.update_confirm(BotAdded.from_json(member, joined_at=member.joined_at.replace(tzinfo=None)))
 
-    async def listen_for_bots_at(self, message: discord.Message, message_check: Callable[[discord.Message], bool]) -> \
-            Tuple[Dict[int, Union[discord.Message, ReactRespond]], Dict[int, Union[discord.Message, ReactRespond]]]:
-        """Listens for bots responding and terminating when a user respond"""
-        bots = {}
-        after_user = {}
-        time_to_listen = message.created_at + datetime.timedelta(seconds=5)
-        flip = 0
-
-        def reaction_add_check(reaction: discord.Reaction, _: discord.User) -> bool:
-            return reaction.message == message
-
-        stuff_here = locals()
-        with contextlib.suppress(asyncio.TimeoutError):
-            while time_to_listen > (time_rn := discord.utils.utcnow()):
-                time_left = (time_to_listen - time_rn).total_seconds()
-                done, didnt = await asyncio.wait(
-                    [self.bot.wait_for(event, check=stuff_here[f"{event}_check"], timeout=time_left) 
-                     for event in ("reaction_add", "message")],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-                for coro in done:
-                    coro.exception()
-
-                responded = done.pop().result()
-                if isinstance(responded, tuple):
-                    responded = ReactRespond(datetime.datetime.utcnow(), responded[1], None)
-
-                for coro in didnt:
-                    coro.cancel()
-
-                if any(responded.author.id in respondance for respondance in (bots, after_user)):
-                    continue
-                flip |= not responded.author.bot
-                if not responded.author.bot:
-                    continue
-
-                if not flip:
-                    bots.update({responded.author.id: responded})
-                elif getattr(responded.reference, "cached_message", None) == message:
-                    after_user.update({responded.author.id: responded})
+    async def listen_for_bots_at(self, message: discord.Message,
+                                 message_check: Optional[Callable[[discord.Message], bool]] = None) -> \
+            Tuple[Dict[int, Responded], Dict[int, Responded]]:
+        """Listens for 5 seconds for bots responding in the channel of message, terminating when a user respond.
+           message_check filters the messages of that channel, reactions are only taken from message itself."""
+        window = self.response_router.open(message, message_check)
+        time_left = message.created_at + datetime.timedelta(seconds=5) - discord.utils.utcnow()
+        try:
+            await asyncio.sleep(time_left.total_seconds())
+        finally:
+            self.response_router.close(window)
 
-        return bots, after_user
+        return window.bots, window.after_user
 
     @commands.Cog.listener("on_member_remove")
     @wait_ready()
@@ -448,7 +539,7 @@ class FindBot(commands.Cog, name="Bots"):
         """Updates the prefix of a bot, or multiple bot where it waits for the bot to respond. It updates in the database."""
         def setting(inner):
             def check(msg):
-                return msg.channel == message.channel and not msg.author.bot or inner(msg)
+                return not msg.author.bot or inner(msg)
             return check
 
         message_sent, after = await self.listen_for_bots_at(message, setting(func))
@@ -470,69 +561,78 @@ class FindBot(commands.Cog, name="Bots"):
         prefix_list = [(message.guild.id, x, prefix, 1, m.created_at.replace(tzinfo=None)) for x, m in message_sent.items()]
         command_list = [(message.guild.id, x, command, m.created_at.replace(tzinfo=None)) for x, m in message_sent.items()]
 
-        await self.insert_both_prefix_command(prefix_list, command_list)
+        self.insert_both_prefix_command(prefix_list, command_list)
 
-        for _, x, prefix, _, _ in prefix_list:
-            prefix_list = self.all_bot_prefixes.setdefault(x, set())
-            prefix_list.add(prefix)
+        for _, bot, prefix, _, _ in prefix_list:
+            self.add_bot_prefix(bot, prefix)
 
         for _, bot, command, _ in command_list:
-            command_list = self.all_bot_commands.setdefault(bot, set())
-            command_list.add(command)
-
-        self.update_compile()
+            self.add_bot_command(bot, command)
 
     @commands.Cog.listener("on_message")
-    @wait_ready()
-    @listen_for_guilds()
-    @is_user()
+    async def dispatch_message(self, message: discord.Message) -> None:
+        """Single entry point of every message for the bot detection. The checks shared by the handlers run once here,
+           then only the handlers that apply to the message are called, each running concurrently."""
+        if not self.bot.is_ready():
+            await self.bot.wait_until_ready()
+
+        self.response_router.route_message(message)
+        if message.author.bot:
+            handlers = [self.is_it_bot_repo, self.is_bot_triggered]
+        else:
+            self.last_human_messages[message.channel.id] = message
+            handlers = []
+            if message.guild is not None:
+                handlers.append(self.find_bot_prefixes)
+                if self.tries_loaded:
+                    handlers.append(self.command_count)
+            if message.channel.id in ADDBOT_CHANNELS:
+                handlers.append(self.addbot_command_tracker)
+
+        if not handlers:
+            return
+
+        # the last handler runs in this task, which is already one that discord.py created for this event
+        *others, last = handlers
+        for handler in others:
+            task = asyncio.create_task(handler(message), name=f"FindBot.{handler.__name__}")
+            self._handler_tasks.add(task)
+            task.add_done_callback(self._handler_done)
+        await last(message)
+
+    @commands.Cog.listener("on_reaction_add")
+    async def route_reaction(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]) -> None:
+        self.response_router.route_reaction(reaction, user)
+
+    def _handler_done(self, task: asyncio.Task[None]) -> None:
+        self._handler_tasks.discard(task)
+        if not task.cancelled() and (error := task.exception()) is not None:
+            print_exception(f"Ignoring exception in {task.get_name()}:", error)
+
     async def find_bot_prefixes(self, message: discord.Message):
         """This function is responsible for point of entry of the bot detection. All bot must went into here
            in order to be detected."""
-        def check_jsk(m):
-            possible_text = ("Jishaku", "discord.py", "Python ", "Module ", "guild(s)", "user(s).")
-            return all(text in m.content for text in possible_text)
-
-        def search(*text_list):
-            def actual_search(search_text):
-                return any(f"{t}" in search_text.casefold() for t in text_list)
-            return actual_search
-
-        def check_help(m):
-            target = search("command", "help", "category", "categories")
-            content = target(m.content)
-            embeds = any(target(str(e.to_dict())) for e in m.embeds)
-            return content or embeds
-
-        def check_ping(m):
-            target = search("ping", "ms", "pong", "latency", "websocket", "bot", "database")
-            content = target(m.content)
-            embeds = any(target(str(e.to_dict())) for e in m.embeds)
-            return content or embeds
-
-        for func in filter(lambda x: getattr(x, "__name__", "").startswith("check"), locals().values()):
-            name = func.__name__.replace("check_", "")
-            if match := re.match("(?P<prefix>^.{{1,30}}?(?={}$))".format(name), message.content, re.I):
-                if name not in match["prefix"]:
-                    return await self.update_prefix_bot(message, func, match["prefix"], name)
+        if not (match := PREFIX_TRIGGER.match(message.content)):
+            return
+
+        name, prefix = match.lastgroup, match["prefix"]
+        if name not in prefix:
+            await self.update_prefix_bot(message, TRIGGER_CHECKS[name], prefix, name)
 
     async def search_respond(
             self,
-            callback: Callable[[Tuple[ctypes.c_char_p, int], ctypes.c_char_p], Coroutine[Any, Any, List[str]]],
+            callback: Callable[[CompiledTrie, bytes], Union[List[str], Awaitable[List[str]]]],
             message: discord.Message, word: str, _type: str
     ) -> Optional[Tuple[filter, List[str], Dict[int, discord.Message]]]:
         """Gets the prefix/command that are in this message, gets the bot that responded
            and return them."""
-        content_compiled = ctypes.create_string_buffer(word.encode("utf-8"))
-        if not (result := await callback(getattr(self, f"compiled_{_type}"), content_compiled)):
+        content = word.encode("utf-8")
+        if not (result := await maybe_coroutine(callback, getattr(self, f"compiled_{_type}"), content)):
             return
 
         singular = _type[:len(_type) - ((_type != "commands") + 1)]
 
-        def check(msg):
-            return msg.channel == message.channel
-
-        bot_found, after = await self.listen_for_bots_at(message, check)
+        bot_found, after = await self.listen_for_bots_at(message)
         if not bot_found and not after:
             return
 
@@ -544,20 +644,15 @@ class FindBot(commands.Cog, name="Bots"):
         responded = filter(lambda x: x["bot_id"] in bot_found, bots)
         return responded, result, bot_found
 
-    async def insert_both_prefix_command(self, prefix_list: List[Union[int, str]], command_list: List[Union[int, str]]) -> None:
-        command_list_query = "INSERT INTO commands_list VALUES($1, $2, $3, $4)"
-        prefix_list_query = "INSERT INTO prefixes_list VALUES($1, $2, $3, $4, $5) " \
-                            "ON CONFLICT (guild_id, bot_id, prefix) DO " \
-                            "UPDATE SET usage=prefixes_list.usage + 1, last_usage=$5"
-        
-        for key in "command_list", "prefix_list":
-            await self.bot.pool_pg.executemany(locals()[f"{key}_query"], locals()[key])
-
-    # @commands.Cog.listener("on_message")
-    # @wait_ready()
-    # @listen_for_guilds()
-    # @prefix_cache_ready()
-    # @is_user()
+    def insert_both_prefix_command(self, prefix_list: List[Union[int, str]], command_list: List[Union[int, str]]) -> None:
+        """Queues the rows into the buffered writer, they are written into the database in batches."""
+        for guild_id, bot_id, command, time_used in command_list:
+            self.writer.add_command(guild_id, bot_id, command, time_used)
+
+        for guild_id, bot_id, prefix, _, last_usage in prefix_list:
+            self.writer.add_prefix(guild_id, bot_id, prefix, last_usage)
+
+    # not in dispatch_message, it would go with command_count for guild messages from users
     async def find_bot_commands(self, message: discord.Message):
         """Get a prefix based on known command used.
            Disabled for now, as the derive detection is dumb."""
@@ -586,22 +681,17 @@ class FindBot(commands.Cog, name="Bots"):
                     commands_values.append((message.guild.id, bot_id, command, message_respond))
 
         for _, bot, prefix, _, _ in prefixes_values:
-            prefixes = self.all_bot_prefixes.setdefault(bot, set())
-            prefixes.add(prefix)
-        self.update_compile()
+            self.add_bot_prefix(bot, prefix)
 
-        await self.insert_both_prefix_command(prefixes_values, commands_values)
+        self.insert_both_prefix_command(prefixes_values, commands_values)
 
-    @commands.Cog.listener("on_message")
-    @wait_ready()
-    @listen_for_guilds()
-    @prefix_cache_ready()
     async def command_count(self, message: discord.Message):
         """
         Checks if the message contains a valid prefix, which will wait for the bot to respond to count that message
         as a command.
         """
-        if not (received := await self.search_respond(search_prefixes, message, message.content[:31], "prefixes")):
+        search = self.prefix_search_batch or search_prefixes
+        if not (received := await self.search_respond(search, message, message.content[:31], "prefixes")):
             return
 
         responded, result, message_sent = received
@@ -619,48 +709,54 @@ class FindBot(commands.Cog, name="Bots"):
                     commands_values.append((message.guild.id, bot_id, got_command, message_respond))
 
         for _, bot, command, _ in commands_values:
-            command_list = self.all_bot_commands.setdefault(bot, set())
-            command_list.add(command)
-        self.update_compile()
+            self.add_bot_command(bot, command)
 
-        await self.insert_both_prefix_command(prefixes_values, commands_values)
+        self.insert_both_prefix_command(prefixes_values, commands_values)
 
-    @commands.Cog.listener("on_message")
-    @wait_ready()
-    @event_check(lambda _, m: m.author.bot)
     async def is_it_bot_repo(self, message: discord.Message):
         def get_content(m: discord.Message) -> str:
             content_inner = m.content
             if m.embeds:
                 embed = m.embeds[0]
-                content_inner += " / " + str(embed.to_dict())
+                texts = embed_text(embed), embed.url, embed.author.url
+                content_inner += " / " + " ".join(filter(None, texts))
             return content_inner
 
         content = get_content(message)
+        if "github.com" not in content:
+            return
+
         bot = message.author
         potential = []
         for match in self.re_github.finditer(content):
-            repo_name = match['repo_name']
-            predicting_name = fuzz.ratio(repo_name, bot.name)
-            predicting_display = fuzz.ratio(repo_name, bot.display_name)
-            if (predict := max([predicting_display, predicting_name])) >= 50:
+            key = bot.id, match['repo_owner'], match['repo_name']
+            if (predict := self.repo_certainties.get(key)) is None:
+                repo_name = match['repo_name']
+                predicting_name = fuzz.ratio(repo_name, bot.name)
+                predicting_display = fuzz.ratio(repo_name, bot.display_name)
+                predict = self.repo_certainties[key] = max([predicting_display, predicting_name])
+            if predict >= 50:
                 potential.append((match, predict))
 
         if potential:
             match, predict = max(potential, key=operator.itemgetter(1))
+            # the upsert only writes a higher certainty, there is nothing to write when one at least as high is stored
+            if self.stored_repo_certainty.get(bot.id, -1) >= predict:
+                return
+
             sql = "INSERT INTO bot_repo VALUES($1, $2, $3, $4) " \
                   "ON CONFLICT (bot_id) DO UPDATE SET owner_repo=$2, bot_name=$3, certainty=$4 " \
-                  "WHERE bot_repo.certainty < $4"
+                  "WHERE bot_repo.certainty < $4 " \
+                  "RETURNING certainty"
             values = (bot.id, match["repo_owner"], match["repo_name"], predict)
-            await self.bot.pool_pg.execute(sql, *values)
+            stored = await self.bot.pool_pg.fetchval(sql, *values)
+            if stored is None:
+                # a higher certainty is already stored, it is not known how high
+                stored = predict
+            self.stored_repo_certainty[bot.id] = stored
 
-    @commands.Cog.listener("on_message")
-    @wait_ready()
-    @is_user()
     async def addbot_command_tracker(self, message: discord.Message):
         """Tracks ?addbot command. This is an exact copy of R. Danny code."""
-        if message.channel.id not in (559455534965850142, 381963689470984203, 381963705686032394):
-            return
         if result := await self.is_valid_addbot(message, check=True):
             confirm = False
 
@@ -778,20 +874,14 @@ class FindBot(commands.Cog, name="Bots"):
         author = author or ctx.author
         if author.bot:
             return await ctx.maybe_reply("That's a bot lol")
-        query = "SELECT * FROM {}_bots WHERE author_id=$1"
-        total_list = [await self.bot.pool_pg.fetch(query.format(x), author.id) for x in ("pending", "confirmed")]
-        total_list = itertools.chain.from_iterable(total_list)
-
-        async def get_member(b_id: int) -> Union[discord.Member, discord.User]:
-            return ctx.guild.get_member(b_id) or await self.bot.fetch_user(b_id)
-        list_bots = [BotAdded.from_json(await get_member(x["bot_id"]), **x) for x in total_list]
+        list_bots, prefixes, commands_used = await self.fetch_author_bots(ctx, author.id)
         embed = StellaEmbed.default(ctx, title=plural(f"{author}'s bot(s)", len(list_bots)))
         for dbot in list_bots:
             bot_id = dbot.bot.id
             value = ""
-            if bprefix := await try_call(BotPrefixes.convert, ctx, str(bot_id)):
+            if bprefix := prefixes.get(bot_id):
                 value += f"**Most Used Prefix:** `{self.clean_prefix(ctx, bprefix.prefix)}`\n"
-            if buse := await try_call(BotCommands.convert, ctx, str(bot_id)):
+            if buse := commands_used.get(bot_id):
                 high_use = buse.highest_command
                 value += f"**Top Command:** `{high_use}`[`{buse.get_command(high_use)}`]\n"
                 value += f"**Total Usage:** `{buse.total_usage}`\n"
@@ -803,6 +893,54 @@ class FindBot(commands.Cog, name="Bots"):
             embed.description = f"{author} doesnt own any bot here."
         await ctx.embed(embed=embed)
 
+    async def fetch_author_bots(self, ctx: StellaContext, author_id: int
+                                ) -> Tuple[List[BotAdded], Dict[int, BotPrefixes], Dict[int, BotCommands]]:
+        """Loads every pending and confirmed bot of an author with their prefixes and command usages in this guild.
+        This is 3 queries no matter how many bots the author has."""
+        query = "SELECT bot_id, author_id, reason, requested_at, jump_url, NULL::TIMESTAMP AS joined_at " \
+                "FROM pending_bots WHERE author_id=$1 " \
+                "UNION ALL " \
+                "SELECT bot_id, author_id, reason, requested_at, jump_url, joined_at " \
+                "FROM confirmed_bots WHERE author_id=$1"
+        rows = await self.bot.pool_pg.fetch(query, author_id)
+        if not rows:
+            return [], {}, {}
+
+        bot_ids = [x["bot_id"] for x in rows]
+        members = await self.resolve_users(ctx, bot_ids)
+        prefix_query = "SELECT * FROM prefixes_list WHERE guild_id=$1 AND bot_id=ANY($2::BIGINT[])"
+        command_query = "SELECT bot_id, command, COUNT(*) AS usage FROM commands_list " \
+                        "WHERE guild_id=$1 AND bot_id=ANY($2::BIGINT[]) GROUP BY bot_id, command"
+        generation = self.bot.prediction_generation
+        prefix_data = await self.bot.pool_pg.fetch(prefix_query, ctx.guild.id, bot_ids)
+        command_data = await self.bot.pool_pg.fetch(command_query, ctx.guild.id, bot_ids)
+        prefixes = await BotPrefixes.from_db_many(ctx, members, prefix_data, generation)
+        commands_used = BotCommands.from_usage_many(members, command_data)
+        list_bots = [BotAdded.from_json(members[x["bot_id"]], **x) for x in rows]
+        return list_bots, {int(x): x for x in prefixes}, {int(x): x for x in commands_used}
+
+    async def resolve_users(self, ctx: StellaContext, user_ids: List[int]
+                            ) -> Dict[int, Union[discord.Member, discord.User]]:
+        """Gets each id as a guild member, falling back to fetching the user. Fetches run concurrently, bounded by
+        USER_FETCH_LIMIT, and their results are kept in fetched_users."""
+        async def fetch_user(user_id: int) -> discord.User:
+            async with self._user_fetches:
+                user = await self.bot.fetch_user(user_id)
+            self.fetched_users[user_id] = user
+            return user
+
+        resolved = {}
+        missing = []
+        for user_id in user_ids:
+            if user := ctx.guild.get_member(user_id) or self.bot.get_user(user_id) or self.fetched_users.get(user_id):
+                resolved[user_id] = user
+            else:
+                missing.append(user_id)
+
+        if missing:
+            resolved.update(zip(missing, await asyncio.gather(*map(fetch_user, missing))))
+        return resolved
+
     @commands.command(aliases=["whoowns", "whosebot", "whoadds", "whoadded"],
                       brief="Shows who added the bot.",
                       help="Shows who added the bot, when they requested it and when the bot was added including the "
@@ -866,19 +1004,14 @@ class FindBot(commands.Cog, name="Bots"):
 
     async def get_all_prefix(self, ctx: StellaContext, prefix: str) -> List[discord.Member]:
         """Quick function that gets the amount of bots that has the same prefix in a server."""
-        sql = "SELECT * FROM prefixes_list WHERE guild_id=$1 AND prefix=$2"
+        sql = "SELECT * FROM prefixes_list " \
+              "WHERE guild_id=$1 AND bot_id IN (SELECT bot_id FROM prefixes_list WHERE guild_id=$1 AND prefix=$2)"
+        generation = self.bot.prediction_generation
         data = await self.bot.pool_pg.fetch(sql, ctx.guild.id, prefix)
-
-        def mem(x):
-            return ctx.guild.get_member(x)
-
-        bot_list = []
-        for each in [mem(x['bot_id']) for x in data if mem(x['bot_id'])]:
-            bot = await BotPrefixes.convert(ctx, f"{each.id}")
-            if prefix in bot.all_raw_prefixes:
-                bot_list.append(bot)
-
-        return bot_list
+        members = {bot_id: member for bot_id in {x['bot_id'] for x in data}
+                   if (member := ctx.guild.get_member(bot_id))}
+        bots = await BotPrefixes.from_db_many(ctx, members, data, generation)
+        return [bot for bot in bots if prefix in bot.all_raw_prefixes]
 
     @commands.command(aliases=["prefixbots", "pbots"],
                       brief="Shows the name of bot(s) have a given prefix.",
@@ -938,14 +1071,16 @@ class FindBot(commands.Cog, name="Bots"):
                        ylabel="Commands")
 
         asset = bot.display_avatar
-        avatar_bytes = io.BytesIO(await asset.read())
-        color = major = await get_majority_color(avatar_bytes)
-        if not islight(*major.to_rgb()) or bot == ctx.me:
-            color = discord.Color(ctx.bot.color)
+        key = chart_key("botinfo", bot.id, ctx.guild.id, payload, names, usages, asset.key)
+        if (picture := chart_cache.get(key)) is None:
+            avatar = await fetch_avatar(asset)
+            color = avatar.color
+            if not avatar.light or bot == ctx.me:
+                color = discord.Color(ctx.bot.color)
 
-        bar = await create_bar(names, usages, str(color), **payload)
-        to_send = await process_image(avatar_bytes, bar)
-        return discord.File(to_send, filename="picture.png")
+            bar = await create_bar(names, usages, str(color), **payload)
+            picture = chart_cache[key] = await process_image(avatar.data, bar)
+        return discord.File(io.BytesIO(picture), filename="picture.png")
 
     async def format_bot_info(self, ctx, bot: Union[discord.Member, discord.User]) -> discord.Embed:
         embed = StellaEmbed.default(ctx, title=str(bot))
@@ -1150,7 +1285,14 @@ class FindBot(commands.Cog, name="Bots"):
     async def delprefix(self, ctx: StellaContext, bot: BotOwner, *prefixes: str):
         query = "DELETE FROM prefixes_list WHERE guild_id=$1 AND bot_id=$2 AND prefix=$3"
         unique_prefixes = set(prefixes)
-        await self.bot.pool_pg.executemany(query, [(ctx.guild.id, bot.bot.id, x) for x in unique_prefixes])
+        bot_id = bot.bot.id
+        await self.bot.pool_pg.executemany(query, [(ctx.guild.id, bot_id, x) for x in unique_prefixes])
+        # prefixes are known globally, only forget the ones that are not used in other servers
+        query = "SELECT DISTINCT prefix FROM prefixes_list WHERE bot_id=$1 AND prefix=ANY($2::VARCHAR[])"
+        remaining = {r["prefix"] for r in await self.bot.pool_pg.fetch(query, bot_id, list(unique_prefixes))}
+        for prefix in unique_prefixes - remaining:
+            self.remove_bot_prefix(bot_id, prefix)
+        self.bot.invalidate_prediction(ctx.guild.id, bot_id)
         await ctx.confirmed()
 
     @_bot.command(help="Add prefixes into a specific bot for bot owners")
@@ -1162,6 +1304,9 @@ class FindBot(commands.Cog, name="Bots"):
         max_usage = max([p['usage'] for p in current_prefixes] or [1])
         values = [(guild_id, bot_id, x, max_usage, datetime.datetime.utcnow()) for x in unique_prefixes]
         await self.bot.pool_pg.executemany(query, values)
+        for prefix in unique_prefixes:
+            self.add_bot_prefix(bot_id, prefix)
+        self.bot.invalidate_prediction(guild_id, bot_id)
         await ctx.maybe_reply(f"Successfully inserted `{'` `'.join(unique_prefixes)}`")
         await ctx.confirmed()
 
@@ -1173,6 +1318,7 @@ class FindBot(commands.Cog, name="Bots"):
 
         values = (bot_id, github_link.repo_owner, github_link.repo_name, 100)
         await self.bot.pool_pg.execute(sql, *values)
+        self.stored_repo_certainty[bot_id] = 100
         await ctx.confirmed()
 
     @greedy_parser.command(
@@ -1273,8 +1419,6 @@ class FindBot(commands.Cog, name="Bots"):
         menu = InteractionPages(each_git_list(data))
         await menu.start(ctx)
 
-    @commands.Cog.listener('on_message')
-    @event_check(lambda _, m: m.author.bot)
     async def is_bot_triggered(self, message: discord.Message):
         def resolve_message(m: discord.Message) -> Optional[discord.Message]:
             if m.reference:
@@ -1283,7 +1427,7 @@ class FindBot(commands.Cog, name="Bots"):
                     return
                 return caught
 
-            return discord.utils.get(reversed(self.bot.cached_messages), author__bot=False, channel__id=m.channel.id)
+            return self.last_human_messages.get(m.channel.id)
 
         if not (triggering := resolve_message(message)):
             return
@@ -1293,13 +1437,7 @@ class FindBot(commands.Cog, name="Bots"):
         if not processed:
             return
 
-        bot_id = message.author.id
-        values = [(bot_id, x.lower(), i, 1) for i, x in enumerate(processed)]
-        sql = "INSERT INTO position_letter VALUES($1, $2, $3, $4) " \
-              "ON CONFLICT(bot_id, letter, position) DO " \
-              "UPDATE SET count = position_letter.count + 1"
-
-        await self.bot.pool_pg.executemany(sql, values)
+        self.writer.add_letters(message.author.id, processed)
 
     @commands.command(aliases=["bpd"], help="Uses neural network to predict a bot's prefix.")
     async def botpredict(self, ctx: StellaContext, *, bot: BotPredictPrefixes):
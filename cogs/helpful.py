@@ -15,7 +15,6 @@ import itertools
 
 from discord import ui
 from discord.ui import View
-from pygit2 import Repository, GIT_SORT_TOPOLOGICAL
 from fuzzywuzzy import process
 from discord.ext import commands
 
@@ -726,6 +725,8 @@ class Helpful(commands.Cog):
         banner = await self.bot.ipc_client.request("generate_banner", **payload)
         if isinstance(banner, str):
             embed.set_image(url=banner)
+        from pygit2 import Repository, GIT_SORT_TOPOLOGICAL
+
         repo = Repository('.git')
         HEAD = repo.head.target
         COMMIT_AMOUNT = 4
@@ -448,6 +448,7 @@ class Myself(commands.Cog):
     async def botupdate(self, ctx: StellaContext):
         jsk = self.bot.get_command("jsk git")
         await jsk(ctx, argument=Codeblock("me", "pull"))
+        await self.bot.refresh_source_lines()
 
     @greedy_parser.command()
     async def changebotvar(self, ctx: StellaContext, key: str, value: UntilFlag[str], *, type: flg.BotVarFlag):
@@ -473,6 +474,18 @@ class Myself(commands.Cog):
             return await ctx.confirmed()
         await ctx.maybe_reply("Unable to find a running command from this message.")
 
+    @commands.command(aliases=["setprefix"], help="Changes the prefix here, no prefix goes back to the default one.")
+    async def changeprefix(self, ctx: StellaContext, prefix: Optional[str] = None):
+        snowflake_id = ctx.guild.id if ctx.guild else ctx.author.id
+        await self.bot.set_prefix(snowflake_id, prefix)
+        await ctx.confirmed()
+
+    @commands.command(help="Shows how well the prefix cache is doing.")
+    async def prefixcache(self, ctx: StellaContext):
+        cache = self.bot.existing_prefix
+        await ctx.maybe_reply(f"`{len(cache):,}`/`{cache.maxsize:,}` cached, hit rate `{cache.hit_rate:.2%}` "
+                              f"(`{cache.hits:,}` hits, `{cache.misses:,}` misses)")
+
     @commands.Cog.listener()
     async def on_command(self, ctx: StellaContext):
         ctx.done = False
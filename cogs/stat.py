@@ -1,12 +1,13 @@
 from __future__ import annotations
 import datetime
 import discord
-import matplotlib
 import io
-from typing import Union, Literal, TYPE_CHECKING, Optional
+import numpy as np
+from typing import List, Tuple, Union, Literal, TYPE_CHECKING, Optional
+import asyncpg
 from utils import flags as flg
 from utils.greedy_parser import UntilFlag, command
-from utils.image_manipulation import get_majority_color, islight, create_graph, process_image, create_bar
+from utils.image_manipulation import fetch_avatar, create_graph, process_image, create_bar, chart_cache, chart_key
 from utils.new_converters import TimeConverter, IsBot
 from utils.useful import StellaContext
 from discord.ext import commands
@@ -14,7 +15,6 @@ from discord.ext import commands
 if TYPE_CHECKING:
     from main import StellaBot
 
-matplotlib.use('Agg')
 TimeConvert = TimeConverter(datetime.timedelta(days=2), datetime.timedelta(weeks=8))
 
 
@@ -57,6 +57,27 @@ class BotActivityFlag(ColorFlag):
         help="Makes the graph curvy, rather than a straight cut. Defaults to False.",
         default=False
     )
+    buckets: Optional[int] = flg.flag(
+        aliases=["B"],
+        help="The amount of points plotted on the graph, this flag must be between 4 and 48. Defaults to 10.",
+        default=10
+    )
+
+
+def bucket_usage(rows: List[asyncpg.Record], start: datetime.datetime, end: datetime.datetime,
+                 buckets: int) -> Tuple[List[datetime.datetime], List[int]]:
+    """Sums hourly usage rows into equally sized buckets between start and end. Returned newest bucket first.
+
+    Each hourly row falls into the bucket its hour starts in, the first hour may start before start.
+    """
+    total_seconds = (end - start).total_seconds()
+    each_time = datetime.timedelta(seconds=total_seconds / buckets)
+    hours = np.array([row["hour"] for row in rows], dtype="datetime64[us]")
+    offsets = np.maximum((hours - np.datetime64(start, "us")) / np.timedelta64(1, "s"), 0)
+    usages = np.array([row["usage"] for row in rows])
+    counts, _ = np.histogram(offsets, bins=buckets, range=(0, total_seconds), weights=usages)
+    x = [start + each_time * each for each in reversed(range(buckets))]
+    return x, counts[::-1].astype(int).tolist()
 
 
 class Stat(commands.Cog, name="Statistic"):
@@ -78,58 +99,49 @@ class Stat(commands.Cog, name="Statistic"):
         time_rn = datetime.datetime.utcnow()
         flags = dict(flags)
         time_given = flags.get("time") or time_rn - datetime.timedelta(days=2)
+        if not 4 <= (buckets := flags.pop("buckets")) <= 48:
+            raise commands.CommandError("Buckets must be between 4 and 48.")
         if isinstance(target, discord.Member):
-            query = "SELECT * FROM commands_list WHERE guild_id=$1 AND bot_id=$2 AND time_used > $3"
+            query = "SELECT hour, usage FROM commands_hourly " \
+                    "WHERE guild_id=$1 AND bot_id=$2 AND hour >= date_trunc('hour', $3::TIMESTAMP)"
             values = (ctx.guild.id, target.id, time_given)
             error = "Looks like no data is present for this bot."
             method = "display_avatar"
         else:
-            query = "SELECT * FROM commands_list WHERE guild_id=$1 AND time_used > $2"
+            query = "SELECT hour, SUM(usage) AS usage FROM commands_hourly " \
+                    "WHERE guild_id=$1 AND hour >= date_trunc('hour', $2::TIMESTAMP) " \
+                    "GROUP BY hour"
             values = (target.id, time_given)
             error = "Looks like i dont know anything in this server."
             method = "icon"
-        
+
         data = await self.bot.pool_pg.fetch(query, *values)
         if not data:
             raise commands.CommandError(error)
-        bot_based_time = {}
-        total_seconds = (time_rn - time_given).total_seconds()
-        each_time = datetime.timedelta(seconds=total_seconds / 10)
-        for each in range(10):
-            within_time = []
-            after = time_rn - each_time * each
-            before = time_rn - each_time * (each + 1)
-            for row in data:
-                if before < row["time_used"] < after:
-                    within_time.append(row)
-
-            bot_based_time.update({before: len(within_time)})
-
-        x = list(bot_based_time)
-        y = list(bot_based_time.values())
+
+        # create_graph expects the newest bucket first
+        x, y = bucket_usage(data, time_given, time_rn, buckets)
 
         asset = getattr(target, method)
-        async with ctx.typing():
-            avatar_bytes = io.BytesIO(await asset.read())
-            if not flags.get("color"):
-                new_color = major = await get_majority_color(avatar_bytes)
-                if not islight(*major.to_rgb()) or member == ctx.me:
-                    new_color = discord.Color(ctx.bot.color)
-                flags["color"] = new_color
-
-            graph = await create_graph(x, y, **flags)
-            to_send = await process_image(avatar_bytes, graph)
+        # without a color flag, the color is derived from the avatar
+        key = chart_key("botactivity", target.id, ctx.guild.id, y, x[-1].replace(minute=0, second=0, microsecond=0),
+                        flags.get("smooth"), str(flags.get("color") or asset.key))
+        if (picture := chart_cache.get(key)) is None:
+            async with ctx.typing():
+                avatar = await fetch_avatar(asset)
+                if not flags.get("color"):
+                    new_color = avatar.color
+                    if not avatar.light or member == ctx.me:
+                        new_color = discord.Color(ctx.bot.color)
+                    flags["color"] = new_color
+
+                graph = await create_graph(x, y, **flags)
+                picture = chart_cache[key] = await process_image(avatar.data, graph)
+
         embed = discord.Embed()
         embed.set_image(url="attachment://picture.png")
         embed.set_author(name=target, icon_url=asset)
-        await ctx.embed(embed=embed, file=discord.File(to_send, filename="picture.png"))
-        graph.close()
-        avatar_bytes.close()
-        to_send.close()
-
-        del graph
-        del avatar_bytes
-        del to_send
+        await ctx.embed(embed=embed, file=discord.File(io.BytesIO(picture), filename="picture.png"))
 
     @command(aliases=["topcommand", "tc", "tcs"],
              help="Generate a bar graph for 10 most used command for a bot.")
@@ -168,23 +180,22 @@ class Stat(commands.Cog, name="Statistic"):
                        ylabel="Commands")
 
         asset = getattr(target, method)
-        async with ctx.typing():
-            avatar_bytes = io.BytesIO(await asset.read())
-            if not (color := flags.color):
-                color = major = await get_majority_color(avatar_bytes)
-                if not islight(*major.to_rgb()) or member == ctx.me:
-                    color = discord.Color(ctx.bot.color)
-
-            bar = await create_bar(names, usages, str(color), **payload)
-            to_send = await process_image(avatar_bytes, bar)
+        key = chart_key("topcommands", target.id, ctx.guild.id, payload, names, usages, str(flags.color or asset.key))
+        if (picture := chart_cache.get(key)) is None:
+            async with ctx.typing():
+                avatar = await fetch_avatar(asset)
+                if not (color := flags.color):
+                    color = avatar.color
+                    if not avatar.light or member == ctx.me:
+                        color = discord.Color(ctx.bot.color)
+
+                bar = await create_bar(names, usages, str(color), **payload)
+                picture = chart_cache[key] = await process_image(avatar.data, bar)
 
         embed = discord.Embed()
         embed.set_image(url="attachment://picture.png")
         embed.set_author(name=target, icon_url=asset)
-        await ctx.embed(embed=embed, file=discord.File(to_send, filename="picture.png"))
-        bar.close()
-        avatar_bytes.close()
-        to_send.close()
+        await ctx.embed(embed=embed, file=discord.File(io.BytesIO(picture), filename="picture.png"))
 
 
 async def setup(bot: StellaBot) -> None:
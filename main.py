@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import asyncio
 import collections
 import contextlib
@@ -9,7 +11,7 @@ import re
 import time
 
 from os.path import dirname, join
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import asyncpg
 import discord
@@ -18,14 +20,17 @@ import numpy as np
 
 from aiogithub import GitHub
 from discord.ext import commands
+from discord.utils import MISSING
 from dotenv import load_dotenv
 
 from utils.buttons import PersistentRespondView
+from utils.cache import LRUCache
 from utils.context_managers import UserLock
 from utils.decorators import event_check, in_executor, wait_ready
+from utils.image_manipulation import start_render_pool
 from utils.ipc import IPCData, StellaClient
 from utils.prefix_ai import DerivativeNeuralNetwork, PrefixNeuralNetwork
-from utils.useful import ListCall, StellaContext, call, count_source_lines, print_exception
+from utils.useful import ListCall, PrefixMatcher, StellaContext, call, count_source_lines, print_exception
 
 dotenv_path = join(dirname(__file__), 'bot_settings.env')
 load_dotenv(dotenv_path)
@@ -33,11 +38,14 @@ load_dotenv(dotenv_path)
 import utils.library_override
 
 to_call = ListCall()
+# seconds set_prefix waits on the server to take a prefix update
+PREFIX_UPDATE_TIMEOUT = 5
 
 
 class StellaBot(commands.Bot):
     def __init__(self, **kwargs):
         self.tester = kwargs.pop("tester", False)
+        self.batch_search = kwargs.pop("batch_search", False)
         self.help_src = kwargs.pop("help_src", None)
         self.db = kwargs.pop("db", None)
         self.user_db = kwargs.pop("user_db", None)
@@ -52,6 +60,7 @@ class StellaBot(commands.Bot):
         self.bot_guild_id = kwargs.pop("bot_guild")
         self.git = GitHub(self.git_token)
         self.pool_pg = None
+        self.source_lines = 0
         self.uptime = None
         self.global_variable = None
         self.all_bot_prefixes = {}
@@ -59,11 +68,21 @@ class StellaBot(commands.Bot):
         self.confirmed_bots = set()
         self.token = kwargs.pop("token", None)
         self.blacklist = set()
-        self.existing_prefix = {}
+        # None marks an id that uses the default prefix. The ttl bounds how long a prefix changed by another process
+        # can stay stale when its invalidation message is missed.
+        self.existing_prefix: LRUCache[int, Optional[PrefixMatcher]] = LRUCache(maxsize=10_000, ttl=3600)
+        self._prefix_lookups: Dict[int, asyncio.Task[Optional[PrefixMatcher]]] = {}
+        # BotPrefixes predictions keyed by (guild_id, bot_id), dropped whenever prefixes_list changes for that key
+        self.prefix_predictions: LRUCache[Tuple[int, int], np.array] = LRUCache(maxsize=1024)
+        # bumped by every invalidation, see store_prediction. Only keys invalidated recently matter, a prediction is
+        # made within seconds of reading its rows.
+        self.prediction_generation = 0
+        self._prediction_invalidated: LRUCache[Tuple[int, int], int] = LRUCache(maxsize=4096)
         self.cached_context = collections.deque(maxlen=100)
         self.command_running = {}
         self.user_lock = {}
         self._default_prefix = kwargs.pop("default_prefix")
+        self._default_prefix_matcher = PrefixMatcher(self._default_prefix)
         self._tester_prefix = kwargs.pop("tester_prefix")
 
         # main bot owner is kept separate
@@ -84,16 +103,37 @@ class StellaBot(commands.Bot):
     @in_executor()
     def get_prefixes_dataset(self, data: List[List[Union[int, str]]]) -> np.array:
         """Get a list of prefixes from database and calculated through Neural Network"""
-        inputs = np.array(data)
-        amounts, epoch_times = inputs[:, 1].astype(np.int32), inputs[:, 2].astype(np.float)
+        predicted, = self.predict_prefixes([data])
+        return predicted
+
+    @in_executor()
+    def get_prefixes_datasets(self, data: Dict[int, List[List[Union[int, str]]]]) -> Dict[int, np.array]:
+        """Same as get_prefixes_dataset for many bots keyed by bot id, every bot is predicted in a single fit."""
+        return dict(zip(data, self.predict_prefixes(list(data.values()))))
+
+    def invalidate_prediction(self, guild_id: int, bot_id: int) -> None:
+        """Drops the prediction of a bot in a guild after its prefixes_list rows changed."""
+        self.prediction_generation += 1
+        self._prediction_invalidated[guild_id, bot_id] = self.prediction_generation
+        self.prefix_predictions.pop((guild_id, bot_id))
+
+    def store_prediction(self, guild_id: int, bot_id: int, prediction: np.array, generation: int) -> None:
+        """Caches a prediction made from rows read at prediction_generation generation. It is not stored when the bot
+        was invalidated since, the rows it was made from are outdated."""
+        if self._prediction_invalidated.get((guild_id, bot_id), 0) <= generation:
+            self.prefix_predictions[guild_id, bot_id] = prediction
+
+    def predict_prefixes(self, datasets: List[List[List[Union[int, str]]]]) -> List[np.array]:
+        sizes = [len(data) for data in datasets]
+        inputs = np.array([row for data in datasets for row in data])
+        amounts, epoch_times = inputs[:, 1].astype(np.int32), inputs[:, 2].astype(float)
 
         # Normalize datasets into between 0 - 1 for ANN
-        # This is done by getting the the current value divided by highest value
-        normalized_amount, normalized_epoch = amounts / amounts.max(), epoch_times / epoch_times.max()
-        normalized = np.dstack((normalized_amount, normalized_epoch))
-        result = self.prefix_neural_network.fit(normalized) * 200
-        predicted = np.column_stack((inputs, result.flat[::]))
-        return predicted
+        # This is done by getting the the current value divided by highest value of the same bot
+        groups = np.repeat(np.arange(len(datasets)), sizes)
+        result = self.prefix_neural_network.predict_many(groups, amounts, epoch_times) * 200
+        predicted = np.column_stack((inputs, result))
+        return np.split(predicted, np.cumsum(sizes)[:-1])
 
     async def add_blacklist(self, snowflake_id, reason):
         timed = datetime.datetime.utcnow()
@@ -188,6 +228,15 @@ class StellaBot(commands.Bot):
     def sync_is_owner(self, user: discord.User) -> bool:
         return user.id in self.owner_ids
 
+    @property
+    def description(self) -> str:
+        """Shows the source lines counted by refresh_source_lines, 0 until the first count is done."""
+        return self._description.format(lines=self.source_lines)
+
+    @description.setter
+    def description(self, value: str) -> None:
+        self._description = value
+
     @property
     def stella(self) -> Optional[discord.User]:
         """Returns discord.User of the owner"""
@@ -223,22 +272,42 @@ class StellaBot(commands.Bot):
                     await message.edit(content=f"Restart lasted {time_taken}")
             print("Server connected.")
 
+    @to_call.append
+    async def refresh_source_lines(self) -> None:
+        """Counts the source lines for the description in the default executor, at startup and after a pull."""
+        try:
+            self.source_lines = await asyncio.get_running_loop().run_in_executor(None, count_source_lines, '.')
+        except Exception as e:
+            print_exception("Ignoring exception while counting source lines:", e)
+
     @to_call.append
     async def loading_cog(self) -> None:
-        """Loads the cog"""
+        """Loads every cog one after another, then prints how long each of them took"""
         exclude = "_", "."
 
         cogs = [file for file in os.listdir("cogs") if not file.startswith(exclude)]
-        for cog in cogs:
-            name = cog[:-3] if cog.endswith(".py") else cog
-            try:
-                await self.load_extension(f"cogs.{name}")
-            except Exception as e:
-                print_exception('Ignoring exception while loading up {}:'.format(name), e)
-            else:
-                print(f"cog {name} is loaded")
-
-        await bot.load_extension("jishaku")
+        extensions = [f"cogs.{cog[:-3] if cog.endswith('.py') else cog}" for cog in cogs]
+        # importing and setting up an extension barely yields, loading them concurrently would not be any faster and
+        # each timing would include the work of the others
+        start = time.perf_counter()
+        timings = [await self.timed_load_extension(name) for name in [*extensions, "jishaku"]]
+        total = time.perf_counter() - start
+
+        report = [f"{name:<25}{taken * 1000:>10.2f}ms {status}"
+                  for name, taken, status in sorted(timings, key=lambda t: t[1], reverse=True)]
+        print("Extension startup report:", *report, f"{'total':<25}{total * 1000:>10.2f}ms", sep="\n")
+
+    async def timed_load_extension(self, name: str) -> Tuple[str, float, str]:
+        """Loads an extension, returns its name, the seconds it took and whether it loaded."""
+        start = time.perf_counter()
+        try:
+            await self.load_extension(name)
+        except Exception as e:
+            print_exception('Ignoring exception while loading up {}:'.format(name), e)
+            status = "failed"
+        else:
+            status = "loaded"
+        return name, time.perf_counter() - start, status
 
     @to_call.append
     async def fill_bots(self) -> None:
@@ -262,33 +331,70 @@ class StellaBot(commands.Bot):
 
         Set snowflake_id to id of guild if message originates in guild (guild object is present). Otherwise author id.
 
-        Go to cached prefixes and try to get prefix using snowflake_id i created above. If found, skip next paragraph.
+        Go to cached prefixes and try to get the prefix matcher using snowflake_id i created above. If found, skip next
+        paragraph.
 
-        If prefix is not present, select prefix field from internal_prefix postgres table using snowflake_id i created
+        If matcher is not present, select prefix field from internal_prefix postgres table using snowflake_id i created
         earlier as a key then try to get prefix from returned data. If nothing was returned, use default prefix, idrc.
-        After doing that put resulting prefix back into in-memory cache because constant postgres lookups are no good.
-
-        Escape special characters in prefix, then compile it as regular expression using case insensivity flag (yes, i
-        know i could compile them in cache but has anyone asked?). Try matching the beginning of message content using
-        regex. If match found, return match group 0 which will be just the prefix itself. Otherwise return the stored
-        prefix/the default prefix.
+        After doing that put a matcher of resulting prefix back into in-memory cache because constant postgres lookups
+        are no good. Ids using the default prefix are cached as None, so they all share the default matcher. Messages
+        arriving while the lookup is running wait for that same lookup instead of making their own. The cache is
+        bounded, least recently seen ids are dropped and looked up again when they come back.
+
+        The matcher holds the prefix already escaped and compiled as case insensitive regular expression (yes, i finally
+        compiled them in cache). Try matching the beginning of message content using it. If match found, return match
+        group 0 which will be just the prefix itself. Otherwise return the stored prefix/the default prefix.
         """
         if self.tester:
             return self._tester_prefix
 
         snowflake_id = message.guild.id if message.guild else message.author.id
 
-        if (prefix := self.existing_prefix.get(snowflake_id)) is None:
-            data = await self.pool_pg.fetchrow(
-                "SELECT prefix FROM internal_prefix WHERE snowflake_id=$1",
-                snowflake_id,
-            )
-            prefix = self._default_prefix if data is None else data["prefix"]
-            self.existing_prefix[snowflake_id] = prefix
+        if (matcher := self.existing_prefix.get(snowflake_id, MISSING)) is MISSING:
+            if (lookup := self._prefix_lookups.get(snowflake_id)) is None:
+                lookup = self._prefix_lookups[snowflake_id] = asyncio.create_task(self.fetch_prefix(snowflake_id))
+                lookup.add_done_callback(lambda task: self._end_prefix_lookup(snowflake_id, task))
+            # shielded so a cancelled message does not cancel the lookup for the other messages waiting on it
+            matcher = await asyncio.shield(lookup)
 
-        if match := re.match(re.escape(prefix), message.content, flags=re.I):
-            return match[0]
-        return prefix
+        return (matcher or self._default_prefix_matcher).match(message.content)
+
+    async def fetch_prefix(self, snowflake_id: int) -> Optional[PrefixMatcher]:
+        """Reads the prefix of a guild or a dm author from the database into existing_prefix, None for default"""
+        data = await self.pool_pg.fetchrow(
+            "SELECT prefix FROM internal_prefix WHERE snowflake_id=$1",
+            snowflake_id,
+        )
+        matcher = None if data is None else PrefixMatcher(data["prefix"])
+        # the prefix may have changed while this was reading, invalidate_prefix unregisters the lookup when it does
+        if self._prefix_lookups.get(snowflake_id) is asyncio.current_task():
+            self.existing_prefix[snowflake_id] = matcher
+        return matcher
+
+    def _end_prefix_lookup(self, snowflake_id: int, lookup: asyncio.Task[Optional[PrefixMatcher]]) -> None:
+        if self._prefix_lookups.get(snowflake_id) is lookup:
+            del self._prefix_lookups[snowflake_id]
+
+    def invalidate_prefix(self, snowflake_id: int) -> None:
+        """Drops the cached prefix of an id, a lookup still running for it will not write its result back."""
+        self.existing_prefix.pop(snowflake_id)
+        self._prefix_lookups.pop(snowflake_id, None)
+
+    async def set_prefix(self, snowflake_id: int, prefix: Optional[str]) -> None:
+        """Changes the prefix of a guild or a dm author, None goes back to the default prefix. Every other process
+        drops its cached prefix for that id through the global_prefix_update message."""
+        if prefix is None or prefix == self._default_prefix:
+            await self.pool_pg.execute("DELETE FROM internal_prefix WHERE snowflake_id=$1", snowflake_id)
+        else:
+            query = "INSERT INTO internal_prefix VALUES($1, $2) ON CONFLICT (snowflake_id) DO UPDATE SET prefix=$2"
+            await self.pool_pg.execute(query, snowflake_id, prefix)
+        self.invalidate_prefix(snowflake_id)
+        try:
+            # the prefix already changed here, other processes fall back to the cache ttl if this does not get through
+            await asyncio.wait_for(self.ipc_client.request("global_prefix_update", snowflake_id=snowflake_id),
+                                   timeout=PREFIX_UPDATE_TIMEOUT)
+        except Exception as e:
+            print_exception("Failure to send the prefix update to the server.", e)
 
     def get_message(self, message_id: int) -> discord.Message:
         """Gets the message from the cache"""
@@ -332,6 +438,7 @@ class StellaBot(commands.Bot):
             await self.start(self.token)
 
     def starter(self):
+        start_render_pool()
         with contextlib.suppress(KeyboardInterrupt):
             asyncio.run(self.main())
 
@@ -351,6 +458,7 @@ bot_data = {
     "user_db": states.get("USER"),
     "pass_db": states.get("PASSWORD"),
     "tester": states.get("TEST"),
+    "batch_search": states.get("BATCH_SEARCH", False),
     "help_src": states.get("HELP_SRC"),
     "ipc_port": states.get("IPC_PORT"),
     "ipc_key": states.get("IPC_KEY"),
@@ -361,8 +469,8 @@ bot_data = {
     "prefix_derivative": states.get("PREFIX_DERIVATIVE_PATH"),
     "git_token": states.get("GIT_TOKEN"),
     "activity": discord.Activity(type=discord.ActivityType.listening, name="logged to my pc."),
-    "description": "{}'s personal bot that is partially for the public. "
-                   f"Written with only `{count_source_lines('.'):,}` lines. plz be nice"
+    "description": "{{}}'s personal bot that is partially for the public. "
+                   "Written with only `{lines:,}` lines. plz be nice"
 }
 
 bot = StellaBot(**bot_data)
@@ -429,6 +537,13 @@ async def on_restarting_server(_: IPCData) -> None:
     print("Server Connection Successful.")
 
 
+@bot.ipc_client.listen()
+async def on_global_prefix_update(data: IPCData) -> None:
+    # the response to our own set_prefix request comes through here as well
+    if (snowflake_id := data.get("snowflake_id")) is not None:
+        bot.invalidate_prefix(snowflake_id)
+
+
 @bot.ipc_client.listen()
 async def on_kill(data: IPCData) -> None:
     print("Kill has been ordered", data)
@@ -9,6 +9,21 @@ CREATE TABLE IF NOT EXISTS commands_list(
      command VARCHAR(100) NOT NULL,
      time_used TIMESTAMP);
 
+CREATE TABLE IF NOT EXISTS commands_hourly(
+     guild_id BIGINT NOT NULL,
+     bot_id BIGINT NOT NULL,
+     hour TIMESTAMP NOT NULL,
+     usage INTEGER NOT NULL,
+     PRIMARY KEY(guild_id, bot_id, hour));
+
+-- Backfill the rollup from commands that were stored before it existed
+INSERT INTO commands_hourly
+     SELECT guild_id, bot_id, date_trunc('hour', time_used), COUNT(*)
+     FROM commands_list
+     WHERE time_used IS NOT NULL
+     GROUP BY guild_id, bot_id, date_trunc('hour', time_used)
+ON CONFLICT DO NOTHING;
+
 CREATE TABLE IF NOT EXISTS prefixes_list(
      guild_id BIGINT NOT NULL,
      bot_id BIGINT NOT NULL,
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import datetime
+
+from typing import TYPE_CHECKING, Counter, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from utils.useful import print_exception
+
+if TYPE_CHECKING:
+    from main import StellaBot
+
+CommandRow = Tuple[int, int, str, datetime.datetime]
+PrefixKey = Tuple[int, int, str]
+LetterKey = Tuple[int, str, int]
+# VARCHAR(100) of commands_list.command and prefixes_list.prefix, longer values are never real commands or prefixes
+MAX_NAME_LENGTH = 100
+
+
+class BufferedWriter:
+    """Write-behind queue for commands_list, prefixes_list and position_letter.
+
+    Every command written also increments its hour in commands_hourly, the rollup that is read by the graphs.
+
+    Rows are kept in memory and written in a single transaction with COPY once max_rows are pending or every
+    interval seconds, whichever comes first. Prefix usages are summed per (guild_id, bot_id, prefix) and letter counts
+    per (bot_id, letter, position) before they reach postgres, so a hot key costs one upsert per flush instead of one
+    per message. Once prefixes are written, the predictions of their bots are dropped with bot.invalidate_prediction.
+
+    Values that cannot fit their column are skipped when added. A batch that postgres still rejects as invalid data is
+    dropped, any other failure keeps the rows for the next flush until max_attempts flushes failed in a row.
+    """
+    def __init__(self, bot: StellaBot, *, max_rows: int = 500, interval: float = 10, max_attempts: int = 5):
+        self.bot = bot
+        self.max_rows = max_rows
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._failures = 0
+        self._commands: List[CommandRow] = []
+        self._prefixes: Dict[PrefixKey, Tuple[int, datetime.datetime]] = {}
+        self._letters: Counter[LetterKey] = collections.Counter()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._commands) + len(self._prefixes) + len(self._letters)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Stops the background flushing and writes whatever is left.
+
+        A flush that is already writing is waited on rather than cancelled, so its rows are never dropped."""
+        if self._task is not None:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def add_command(self, guild_id: int, bot_id: int, command: str, time_used: datetime.datetime) -> None:
+        if len(command) > MAX_NAME_LENGTH:
+            return
+        self._commands.append((guild_id, bot_id, command, time_used))
+        self._check_size()
+
+    def add_prefix(self, guild_id: int, bot_id: int, prefix: str, last_usage: datetime.datetime) -> None:
+        if len(prefix) > MAX_NAME_LENGTH:
+            return
+        key = guild_id, bot_id, prefix
+        usage, previous = self._prefixes.get(key, (0, last_usage))
+        self._prefixes[key] = usage + 1, max(previous, last_usage)
+        self._check_size()
+
+    def add_letters(self, bot_id: int, content: str) -> None:
+        """Counts each lowered letter of content at its position, content is expected to be already trimmed.
+        Letters that lower into more than one character, such as 'İ', do not fit position_letter and are skipped."""
+        letters = self._letters
+        for position, letter in enumerate(content):
+            if len(lowered := letter.lower()) == 1:
+                letters[bot_id, lowered, position] += 1
+        self._check_size()
+
+    def _check_size(self) -> None:
+        if self.pending >= self.max_rows:
+            self._wake.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wake.clear()
+            if self._closing:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                print_exception("Ignoring exception while flushing buffered rows:", e)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            commands, self._commands = self._commands, []
+            prefixes, self._prefixes = self._prefixes, {}
+            letters, self._letters = self._letters, collections.Counter()
+            if not commands and not prefixes and not letters:
+                return
+
+            try:
+                async with self.bot.pool_pg.acquire() as conn:
+                    async with conn.transaction():
+                        await self._write(conn, commands, prefixes, letters)
+            except asyncpg.DataError as e:
+                # retrying would fail the same way and hold back every row queued after this batch
+                self._failures = 0
+                print_exception(f"Dropping {len(commands) + len(prefixes) + len(letters)} buffered rows that postgres "
+                                f"rejected:", e)
+                return
+            except BaseException as e:
+                if isinstance(e, Exception):
+                    self._failures += 1
+                    if self._failures >= self.max_attempts:
+                        self._failures = 0
+                        print_exception(f"Dropping {len(commands) + len(prefixes) + len(letters)} buffered rows after "
+                                        f"{self.max_attempts} failed flushes:", e)
+                        return
+                # keep the rows for the next flush, new rows may have arrived in the meantime
+                self._commands[:0] = commands
+                for key, (usage, last_usage) in prefixes.items():
+                    current, previous = self._prefixes.get(key, (0, last_usage))
+                    self._prefixes[key] = usage + current, max(previous, last_usage)
+                self._letters.update(letters)
+                raise
+
+            self._failures = 0
+
+            for guild_id, bot_id in {(guild_id, bot_id) for guild_id, bot_id, _ in prefixes}:
+                self.bot.invalidate_prediction(guild_id, bot_id)
+
+    @classmethod
+    async def _write(cls, conn: asyncpg.Connection, commands: List[CommandRow],
+                     prefixes: Dict[PrefixKey, Tuple[int, datetime.datetime]], letters: Counter[LetterKey]) -> None:
+        if commands:
+            columns = ("guild_id", "bot_id", "command", "time_used")
+            await conn.copy_records_to_table("commands_list", records=commands, columns=columns)
+            hourly = collections.Counter(
+                (guild_id, bot_id, time_used.replace(minute=0, second=0, microsecond=0))
+                for guild_id, bot_id, _, time_used in commands
+            )
+            records = [(*key, usage) for key, usage in hourly.items()]
+            await cls._merge(conn, "commands_hourly", ("guild_id", "bot_id", "hour", "usage"), records,
+                             ("guild_id", "bot_id", "hour"), "usage=commands_hourly.usage + EXCLUDED.usage")
+
+        if prefixes:
+            records = [(*key, usage, last_usage) for key, (usage, last_usage) in prefixes.items()]
+            update = "usage=prefixes_list.usage + EXCLUDED.usage, " \
+                     "last_usage=GREATEST(prefixes_list.last_usage, EXCLUDED.last_usage)"
+            await cls._merge(conn, "prefixes_list", ("guild_id", "bot_id", "prefix", "usage", "last_usage"), records,
+                             ("guild_id", "bot_id", "prefix"), update)
+
+        if letters:
+            records = [(*key, count) for key, count in letters.items()]
+            await cls._merge(conn, "position_letter", ("bot_id", "letter", "position", "count"), records,
+                             ("bot_id", "letter", "position"), "count=position_letter.count + EXCLUDED.count")
+
+    @staticmethod
+    async def _merge(conn: asyncpg.Connection, table: str, columns: Sequence[str], records: List[Tuple],
+                     conflict: Sequence[str], update: str) -> None:
+        """COPY cannot resolve conflicts, so rows are staged in a temporary table and upserted from there."""
+        staging = f"{table}_buffer"
+        await conn.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} "
+                           f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        await conn.copy_records_to_table(staging, records=records, columns=columns)
+        # rows are locked in a stable order, so concurrent writers can never deadlock each other
+        keys = ", ".join(f'"{c}"' for c in conflict)
+        await conn.execute(f"INSERT INTO {table} SELECT * FROM {staging} ORDER BY {keys} "
+                           f"ON CONFLICT ({keys}) DO UPDATE SET {update}")
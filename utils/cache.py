@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import collections
+import time
+
+from typing import Generic, Hashable, Optional, OrderedDict, Tuple, TypeVar, Union, overload
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+class LRUCache(Generic[K, V]):
+    """Dictionary like cache that holds at most maxsize items, dropping the least recently used item first.
+
+    When ttl is given, items older than ttl seconds are treated as missing and removed on access.
+    Every get is counted as a hit or a miss, see hit_rate.
+    """
+    def __init__(self, maxsize: int = 128, *, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, Tuple[float, V]] = collections.OrderedDict()
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of get calls that found their key, 0 when get was never called."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.monotonic() - stored_at > self.ttl
+
+    @overload
+    def get(self, key: K) -> Optional[V]:
+        ...
+
+    @overload
+    def get(self, key: K, default: T) -> Union[V, T]:
+        ...
+
+    def get(self, key: K, default: Optional[T] = None) -> Union[V, T, None]:
+        if (item := self._data.get(key)) is None:
+            self.misses += 1
+            return default
+
+        stored_at, value = item
+        if self._expired(stored_at):
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._data[key] = time.monotonic(), value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: K) -> bool:
+        if (item := self._data.get(key)) is None:
+            return False
+        return not self._expired(item[0])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        if (item := self._data.pop(key, None)) is None:
+            return default
+        return item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
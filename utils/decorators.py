@@ -1,8 +1,10 @@
 from __future__ import annotations
 
 import asyncio
+import concurrent.futures
 import functools
 
+from concurrent.futures.process import BrokenProcessPool
 from typing import Any, Awaitable, Callable, Coroutine, Optional, Sequence, Type, TypeVar, Union
 
 import discord
@@ -10,7 +12,7 @@ import discord
 from discord.ext import commands, menus
 from typing_extensions import ParamSpec
 
-from utils.errors import NotInDpy
+from utils.errors import CantRun, NotInDpy
 from utils.menus import MenuBase
 
 DISCORD_PY = 336642139381301249
@@ -115,3 +117,28 @@ def in_executor(loop: _MaybeEventLoop = None) -> Callable[[Callable[P, T]], Call
             return loop_.run_in_executor(None, partial)
         return function
     return inner_function
+
+
+def in_process(executor: Callable[[], concurrent.futures.Executor],
+               limit: Callable[[], asyncio.Semaphore]) -> Callable[[Callable[P, T]], Callable[P, Coro[T]]]:
+    """Makes a sync blocking function run in a process pool, waiting for a free slot when limit is exhausted.
+
+    Both the pool and the semaphore are given as callables, since they can only be created once the bot is running.
+    The function must be defined at module level and its arguments and return value must be picklable. A pool that
+    lost a worker is broken for good, calls then raise CantRun until the bot is restarted.
+    """
+    def inner_function(func: Callable[P, T]) -> Callable[P, Coro[T]]:
+        @functools.wraps(func)
+        async def function(*args: P.args, **kwargs: P.kwargs) -> T:
+            async with limit():
+                loop = asyncio.get_running_loop()
+                try:
+                    return await loop.run_in_executor(executor(), functools.partial(func, *args, **kwargs))
+                except BrokenProcessPool:
+                    raise CantRun("A worker process died, this can't run again until the bot restarts.") from None
+
+        # the pool pickles func by its qualified name, which now belongs to the wrapper. Pointing it at
+        # __wrapped__ lets the worker find the undecorated function through the wrapper.
+        func.__qualname__ = f"{func.__qualname__}.__wrapped__"
+        return function
+    return inner_function
@@ -1,35 +1,120 @@
+from __future__ import annotations
+
+import asyncio
 import datetime
+import hashlib
 import io
 import math
-from typing import Coroutine, Any, List, Optional
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
 
 import discord
 from PIL import Image, ImageEnhance, ImageFilter
-import matplotlib.dates as mdates
-import matplotlib.colors as mcolors
-from matplotlib.axes import Axes
-from matplotlib.figure import Figure
-import matplotlib.patheffects as peffects
-from matplotlib import pyplot as plt
 
 import numpy as np
-from matplotlib.patches import Polygon
-from scipy.interpolate import make_interp_spline
 
-from utils.decorators import in_executor
+from utils.cache import LRUCache
+from utils.decorators import in_process
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
+# matplotlib and scipy are imported inside the chart functions, those only run in the render workers so the bot
+# process never pays for them
+
+# rendering holds the GIL for most of its work, so it runs in its own processes instead of the default thread pool
+RENDER_WORKERS = 2
+# jobs allowed in flight at once, callers past this wait on the loop instead of piling up in the pool queue
+RENDER_BACKLOG = RENDER_WORKERS * 2
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_slots: Optional[asyncio.Semaphore] = None
+
+
+def start_render_pool() -> None:
+    """Forks the render workers, this must run before the bot starts any thread or opens any connection.
+
+    Forking a process that already runs threads can deadlock the child, and the child would inherit the gateway and
+    database sockets. Every worker of a fork pool is started on the first submit and never replaced later, so waiting
+    on a single job here is enough to fork all of them while the process is still clean.
+    """
+    global _render_pool
+    if _render_pool is None:
+        # main.py builds the bot when imported, spawned workers would import it again
+        context = multiprocessing.get_context("fork")
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=context)
+        _render_pool.submit(int).result()
+
+
+def render_pool() -> ProcessPoolExecutor:
+    """Process pool for image work, started by start_render_pool. It is never replaced, if a worker dies the pool is
+    broken and rendering stays unavailable until the bot is restarted."""
+    if _render_pool is None:
+        raise RuntimeError("start_render_pool must be called before the bot starts")
+    return _render_pool
+
+
+def render_slots() -> asyncio.Semaphore:
+    """Semaphore bounding the renders in flight, created on first use so it belongs to the running loop."""
+    global _render_slots
+    if _render_slots is None:
+        _render_slots = asyncio.Semaphore(RENDER_BACKLOG)
+    return _render_slots
+
+# final composited charts, the same bot tends to be requested multiple times within a few minutes
+chart_cache: LRUCache[str, bytes] = LRUCache(maxsize=64, ttl=600)
+# avatars are only used as a blurred background and for their color, a small copy is plenty
+AVATAR_SIZE = 256
+# backgrounds are blurred at a fraction of the chart size and upscaled back
+BLUR_SCALE = 4
+# zlib level 3 encodes in under half the time of the default level for a few percent more bytes, WEBP at high quality
+# is a fraction of the size of either for clients that take it
+ENCODER_OPTIONS = {
+    "PNG": dict(compress_level=3),
+    "WEBP": dict(quality=90, method=4),
+}
+
+
+@dataclass(frozen=True)
+class Avatar:
+    data: bytes
+    color: discord.Color
+    light: bool
+
+
+# keyed by asset key, which changes whenever the avatar does
+avatar_cache: LRUCache[str, Avatar] = LRUCache(maxsize=256, ttl=3600)
+# lives in each render worker, keyed by avatar digest and background size
+_background_cache: LRUCache[Tuple[str, Tuple[int, int]], Image.Image] = LRUCache(maxsize=32)
+
+
+def chart_key(*parts: Any) -> str:
+    """Digest of everything a chart is rendered from, this is used as the key for chart_cache."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
 
 
 def create_gradient_array(color: str, *, alpha_min: Optional[int] = 0, alpha_max: Optional[int] = 1) -> np.array:
+    import matplotlib.colors as mcolors
+
     z = np.empty((100, 1, 4), dtype=float)
     z[:, :, :3] = mcolors.colorConverter.to_rgb(color)
     z[:, :, -1] = np.linspace(alpha_min, alpha_max, 100)[:, None]
     return z
 
 
-@in_executor()
-def create_graph(x: List[datetime.datetime], y: List[int], **kwargs: int):
+@in_process(render_pool, render_slots)
+def create_graph(x: List[datetime.datetime], y: List[int], **kwargs: Any) -> bytes:
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Polygon
+    from scipy.interpolate import make_interp_spline
+
     color = str(kwargs.get("color"))
-    fig, axes = plt.subplots()
+    fig = Figure()
+    axes = fig.subplots()
     date_np = np.array(sorted(x))
     value_np = np.array([*reversed(y)])
     date_num = mdates.date2num(date_np)
@@ -67,14 +152,7 @@ def create_graph(x: List[datetime.datetime], y: List[int], **kwargs: int):
     axes.get_xaxis().set_major_formatter(mdates.DateFormatter('%d/%m'))
     axes.grid(True)
     axes.autoscale(True)
-    value = save_matplotlib(fig, axes)
-
-    # yes i'm aware on how this looks, but it must be done.
-    del im
-    del clip_path
-    del axes
-    del line
-    return value
+    return save_matplotlib(fig, axes)
 
 
 def hilo(a: int, b: int, c: int) -> int:
@@ -96,10 +174,15 @@ def inverse_color(*rgb: int) -> List[int]:
     return [*map(lambda x: 255 - x, rgb)]
 
 
-@in_executor()
-def create_bar(x_val: List[Any], y_val: List[Any], color: str, **kwargs: Any) -> Coroutine[Any, Any, io.BytesIO]:
+@in_process(render_pool, render_slots)
+def create_bar(x_val: List[Any], y_val: List[Any], color: str, **kwargs: Any) -> bytes:
+    import matplotlib.colors as mcolors
+    import matplotlib.patheffects as peffects
+    from matplotlib.figure import Figure
+
     h = len(x_val) * .48
-    fig, axes = plt.subplots(figsize=(6.4, h))
+    fig = Figure(figsize=(6.4, h))
+    axes = fig.subplots()
     bars = axes.barh(x_val, y_val, edgecolor=color)
 
     temp = discord.Color(int(color.replace("#", "0x"), base=16))
@@ -147,45 +230,71 @@ def create_bar(x_val: List[Any], y_val: List[Any], color: str, **kwargs: Any) ->
     return save_matplotlib(fig, axes)
 
 
-def save_matplotlib(fig: Figure, axes: Axes) -> io.BytesIO:
-    fig.delaxes(axes)
-    fig.add_axes(axes)
-    buffer = io.BytesIO()
-    fig.savefig(buffer, transparent=True, bbox_inches="tight")
-    axes.clear()
-    fig.clf()
-    plt.close(fig)
-    return buffer
-
-
-@in_executor()
-def process_image(avatar_bytes: io.BytesIO, target: io.BytesIO) -> io.BytesIO:
-    with Image.open(avatar_bytes).convert('RGBA') as avatar, Image.open(target) as target:
-        side = max(avatar.size)
-        avatar = avatar.crop((0, 0, side, side))
-        w, h = target.size
-        avatar = avatar.resize((w, w))
+def save_matplotlib(fig: Figure, axes: Axes) -> bytes:
+    # a Figure that never went through pyplot is not tracked anywhere, it is freed once it goes out of scope
+    with io.BytesIO() as buffer:
+        fig.savefig(buffer, transparent=True, bbox_inches="tight")
+        axes.clear()
+        fig.clf()
+        return buffer.getvalue()
+
+
+def blurred_background(avatar_bytes: bytes, size: Tuple[int, int]) -> Image.Image:
+    """Darkened and blurred avatar on the dark theme color, covering size from the top left.
+
+    The blur runs at 1 / BLUR_SCALE of the size and is upscaled afterwards, which looks the same at a fraction
+    of the cost. Results are kept per worker process in _background_cache, callers get a copy.
+    """
+    key = hashlib.sha1(avatar_bytes).hexdigest(), size
+    if (background := _background_cache.get(key)) is None:
+        w, h = size
+        small_w, small_h = math.ceil(w / BLUR_SCALE), math.ceil(h / BLUR_SCALE)
+        with Image.open(io.BytesIO(avatar_bytes)) as avatar:
+            avatar = avatar.convert('RGBA')
+            side = max(avatar.size)
+            avatar = avatar.crop((0, 0, side, side)).resize((small_w, small_w), Image.LANCZOS)
+            avatar = avatar.crop((0, 0, small_w, small_h))
+            avatar = ImageEnhance.Brightness(avatar).enhance(0.378)
+            avatar = avatar.filter(ImageFilter.GaussianBlur(8 / BLUR_SCALE))
+            avatar = avatar.resize(size, Image.BICUBIC, box=(0, 0, w / BLUR_SCALE, h / BLUR_SCALE))
+        background = Image.new('RGBA', size, (*discord.Color.dark_theme().to_rgb(), 255))
+        background.alpha_composite(avatar)
+        _background_cache[key] = background
+    return background.copy()
+
+
+@in_process(render_pool, render_slots)
+def process_image(avatar_bytes: bytes, target_bytes: bytes, *, image_format: str = "PNG") -> bytes:
+    """Places target on top of a blurred avatar, encoded as image_format which is either PNG or WEBP."""
+    with Image.open(io.BytesIO(target_bytes)) as target:
         offset_below = 10
-        avatar = avatar.crop((0, 0, w, h + offset_below))
-        reducer = ImageEnhance.Brightness(avatar)
-        background = reducer.enhance(0.378)
-        background = background.filter(ImageFilter.GaussianBlur(8))
-        gray_back = Image.new('RGBA', avatar.size, (*discord.Color.dark_theme().to_rgb(), 255))
-        gray_back.paste(background, [0, 0], mask=background)
-        background = gray_back
+        w, h = target.size
+        background = blurred_background(avatar_bytes, (w, h + offset_below))
         background.paste(target, [0, 0], mask=target)
-        to_send = io.BytesIO()
-        background.save(to_send, format="PNG")
-        gray_back.close()
-        to_send.seek(0)
-        return to_send
+        with io.BytesIO() as to_send:
+            background.save(to_send, format=image_format, **ENCODER_OPTIONS[image_format])
+            background.close()
+            return to_send.getvalue()
 
 
-@in_executor()
-def get_majority_color(b: io.BytesIO) -> discord.Color:
-    with Image.open(b) as target:
+@in_process(render_pool, render_slots)
+def prepare_avatar(avatar_bytes: bytes) -> Tuple[bytes, discord.Color]:
+    """Downsamples an avatar to at most AVATAR_SIZE and finds its majority color from the smaller copy."""
+    with Image.open(io.BytesIO(avatar_bytes)) as target:
+        target.thumbnail((AVATAR_SIZE, AVATAR_SIZE))
         smol = target.quantize(4)
-        return discord.Color.from_rgb(*smol.getpalette()[:3])
+        color = discord.Color.from_rgb(*smol.getpalette()[:3])
+        with io.BytesIO() as buffer:
+            target.save(buffer, format="PNG")
+            return buffer.getvalue(), color
+
+
+async def fetch_avatar(asset: discord.Asset) -> Avatar:
+    """Reads an asset once and keeps its downsampled bytes and color in avatar_cache."""
+    if (avatar := avatar_cache.get(asset.key)) is None:
+        data, color = await prepare_avatar(await asset.read())
+        avatar = avatar_cache[asset.key] = Avatar(data, color, islight(*color.to_rgb()))
+    return avatar
 
 
 def islight(r: int, g: int, b: int) -> bool:
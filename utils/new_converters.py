@@ -1,14 +1,14 @@
 from __future__ import annotations
 import typing
 
+import asyncpg
 import discord
 import os
 import re
 import contextlib
 import datetime
 import humanize
-import numpy as np
-from collections import namedtuple, Counter
+from collections import defaultdict, namedtuple, Counter
 from typing import Any, List, Optional, Union, Tuple, Generator, TypeVar, ClassVar, Dict
 
 from discord.ext.commands.view import StringView
@@ -87,10 +87,14 @@ class BotData:
     @classmethod
     async def convert(cls, ctx: StellaContext, argument: str) -> Tuple[discord.Member, Any]:
         member = await IsBot().convert(ctx, argument)
+        return member, await cls.fetch(ctx, member)
+
+    @classmethod
+    async def fetch(cls, ctx: StellaContext, member: discord.Member) -> List[asyncpg.Record]:
         table = cls.__name__.replace("Bot", "").lower()
         query = f"SELECT * FROM {table}_list WHERE guild_id=$1 AND bot_id=$2"
         if data := await ctx.bot.pool_pg.fetch(query, ctx.guild.id, member.id):
-            return member, data
+            return data
         raise NotInDatabase(member)
 
     def __int__(self) -> int:
@@ -107,23 +111,51 @@ class BotPrefixes(BotData):
 
     @classmethod
     async def convert(cls, ctx: StellaContext, argument: str) -> "BotPrefixes":
-        member, data = await super().convert(ctx, argument)
-        return await cls.from_db(ctx, member, data)
+        member = await IsBot().convert(ctx, argument)
+        if (prediction := ctx.bot.prefix_predictions.get((ctx.guild.id, member.id))) is not None:
+            return cls(member, prediction)
+        generation = ctx.bot.prediction_generation
+        return await cls.from_db(ctx, member, await cls.fetch(ctx, member), generation)
 
     @classmethod
-    async def from_db(cls, ctx: StellaContext, member, data):
+    async def from_db(cls, ctx: StellaContext, member, data, generation: int):
+        """generation is bot.prediction_generation from before data was read."""
         processed = [[x["prefix"], x["usage"], x["last_usage"].timestamp()] for x in data]
         prediction = await ctx.bot.get_prefixes_dataset(processed)
+        ctx.bot.store_prediction(ctx.guild.id, member.id, prediction, generation)
         return cls(member, prediction)
 
+    @classmethod
+    async def from_db_many(cls, ctx: StellaContext, members: Dict[int, discord.Member],
+                           data: List[asyncpg.Record], generation: int) -> List[BotPrefixes]:
+        """Same as from_db for prefixes_list rows of many bots, every bot in members is predicted in one go.
+        Bots without any rows are left out, bots with a cached prediction are not predicted again."""
+        cache = ctx.bot.prefix_predictions
+        predictions = {}
+        processed = defaultdict(list)
+        for x in data:
+            bot_id = x["bot_id"]
+            if bot_id not in members or bot_id in predictions:
+                continue
+            if (prediction := cache.get((ctx.guild.id, bot_id))) is not None:
+                predictions[bot_id] = prediction
+            else:
+                processed[bot_id].append([x["prefix"], x["usage"], x["last_usage"].timestamp()])
+
+        if processed:
+            for bot_id, prediction in (await ctx.bot.get_prefixes_datasets(processed)).items():
+                predictions[bot_id] = prediction
+                ctx.bot.store_prediction(ctx.guild.id, bot_id, prediction, generation)
+        return [cls(members[bot_id], prediction) for bot_id, prediction in predictions.items()]
+
     @property
     def prefix(self) -> str:
-        return str(self.predicted_data[self.predicted_data[:, 3].astype(np.float).argmax()][0])
+        return str(self.predicted_data[self.predicted_data[:, 3].astype(float).argmax()][0])
 
     @property
     def aliases(self) -> str:
         prefixes = self.predicted_data
-        potential = prefixes[prefixes[:, 3].astype(np.float) >= 50]
+        potential = prefixes[prefixes[:, 3].astype(float) >= 50]
         alias = potential[potential[:, 0] != self.prefix]
         return alias[:, 0].tolist()
 
@@ -161,6 +193,16 @@ class BotCommands(BotData):
         total_usage = sum(v for v in commands.values())
         return cls(member, commands, command_usages, total_usage)
 
+    @classmethod
+    def from_usage_many(cls, members: Dict[int, discord.Member], data: List[asyncpg.Record]) -> List[BotCommands]:
+        """Builds from (bot_id, command, usage) rows that are already counted by the database, for many bots at once.
+        command_usages is left empty since the times each command was used are not loaded."""
+        counted = defaultdict(Counter)
+        for x in data:
+            if x["bot_id"] in members:
+                counted[x["bot_id"]][x["command"]] = x["usage"]
+        return [cls(members[bot_id], commands, {}, sum(commands.values())) for bot_id, commands in counted.items()]
+
     def get_command(self, command: str) -> str:
         return self._commands.get(command)
 
@@ -1,9 +1,11 @@
 from __future__ import annotations
+import os
 import numpy as np
-from typing import Optional
-from tensorflow import keras
+from typing import Optional, TYPE_CHECKING
 from typing import Dict, Union, List, Tuple
-from utils.decorators import in_executor
+
+if TYPE_CHECKING:
+    from tensorflow import keras
 
 
 class PrefixNeuralNetwork:
@@ -87,21 +89,45 @@ class PrefixNeuralNetwork:
         result = self.calc_layer(layer1, self.weights2)
         return result
 
+    def predict_many(self, groups: np.array, amounts: np.array, epoch_times: np.array) -> np.array[float]:
+        """Same as fit for the prefixes of many bots at once. groups holds the index of the bot each row belongs to,
+           amounts and epoch times are normalized against the highest value of their own bot.
+        """
+        size = groups.max() + 1
+        max_amounts, max_epoch_times = np.zeros(size), np.zeros(size)
+        np.maximum.at(max_amounts, groups, amounts)
+        np.maximum.at(max_epoch_times, groups, epoch_times)
+        normalized = np.column_stack((amounts / max_amounts[groups], epoch_times / max_epoch_times[groups]))
+        return self.fit(normalized).ravel()
+
 
 class DerivativeNeuralNetwork:
+    """Normalization followed by 3 Dense layers, ran with numpy from weights exported to a .npz by export_weights.
+    Tensorflow is only needed when export_weights is given a keras checkpoint."""
+    input_output_size = 30
+
     def __init__(self, path: str):
-        self.input_output_size = 30
-        self.model = self.create_neural_network_model(path)
+        if not path.endswith(".npz"):
+            path = self.export_weights(path)
+
+        with np.load(path) as weights:
+            # keras Normalization divides by the standard deviation clipped at keras epsilon
+            self.mean = weights["mean"]
+            self.std = np.maximum(np.sqrt(weights["variance"]), 1e-7)
+            self.layers = [(weights[f"kernel{i}"], weights[f"bias{i}"]) for i in range(3)]
+
+    @classmethod
+    def create_neural_network_model(cls, path: str) -> keras.Sequential:
+        from tensorflow import keras
 
-    def create_neural_network_model(self, path: str) -> keras.Sequential:
         normalization = keras.layers.Normalization(axis=-1)
-        SIZE = self.input_output_size
+        SIZE = cls.input_output_size
         normalization.adapt(np.zeros(SIZE * 2).reshape((2, SIZE)))
         model = keras.Sequential([
             normalization,
             keras.layers.Dense(40, activation='relu'),
             keras.layers.Dense(40, activation='relu'),
-            keras.layers.Dense(self.input_output_size, activation='sigmoid')
+            keras.layers.Dense(SIZE, activation='sigmoid')
         ])
 
         model.compile(optimizer='adam',
@@ -111,12 +137,35 @@ class DerivativeNeuralNetwork:
         model.load_weights(path)
         return model
 
-    @in_executor()
+    @classmethod
+    def export_weights(cls, path: str, destination: Optional[str] = None) -> str:
+        """Writes the weights of a keras checkpoint into a .npz next to it unless it already exists.
+        Returns the path of the .npz."""
+        destination = destination or f"{os.path.splitext(path)[0]}.npz"
+        if os.path.exists(destination):
+            return destination
+
+        normalization, *dense = cls.create_neural_network_model(path).layers
+        mean, variance, *_ = normalization.get_weights()
+        weights = {"mean": mean.ravel(), "variance": variance.ravel()}
+        for i, layer in enumerate(dense):
+            weights[f"kernel{i}"], weights[f"bias{i}"] = layer.get_weights()
+
+        np.savez(destination, **weights)
+        return destination
+
+    def forward(self, x: np.array) -> np.array:
+        x = (x - self.mean) / self.std
+        *hidden, (kernel, bias) = self.layers
+        for hidden_kernel, hidden_bias in hidden:
+            x = np.maximum(x @ hidden_kernel + hidden_bias, 0)
+        return 1.0 / (1 + np.exp(-(x @ kernel + bias)))
+
     def predict(self, raw_data: Dict[str, Union[float, int, str]], *,
                 return_raw: Optional[bool] = False) -> Union[str, Tuple[str, List[Tuple[str, float]]]]:
         data = [(d["letter"], d["position"], d["percentage"]) for d in raw_data]
         x, original = self.process_input(data)
-        output, = self.model.predict(x)
+        output, = self.forward(x)
         best = output[output >= 0.5]
         evaluated = "".join(letter for letter, _ in original[:len(best)])
         if return_raw:
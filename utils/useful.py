@@ -5,8 +5,10 @@ import contextlib
 import ctypes
 import datetime
 import inspect
+import itertools
 import operator
 import os
+import re
 import sys
 import textwrap
 import traceback
@@ -22,7 +24,7 @@ from discord.ext import commands
 from discord.utils import maybe_coroutine
 
 from utils.context_managers import BreakableTyping
-from utils.decorators import in_executor, pages
+from utils.decorators import pages
 
 # TODO: do some detail documentation, cause im lazy
 
@@ -89,54 +91,170 @@ def default_date(datetime_var: datetime.datetime) -> str:
 
 
 lib = ctypes.CDLL("./c_codes/parse_find.so")
-multi_find_prefix = lib.multi_find_prefix
-freeing = lib.free_result
-multi_find_prefix.restype = ctypes.c_void_p
+create_trie = lib.create_trie
+create_trie.restype = ctypes.c_void_p
+create_trie.argtypes = []
+trie_insert = lib.trie_insert
+trie_insert.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+trie_remove = lib.trie_remove
+trie_remove.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+find_prefix = lib.find_prefix
+find_prefix.restype = ctypes.c_int
+find_prefix.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+find_prefix_many = lib.find_prefix_many
+find_prefix_many.restype = ctypes.c_int
+find_prefix_many.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p), ctypes.c_int,
+                             ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int), ctypes.c_int]
 find_commands = lib.find_commands
-find_commands.restype = ctypes.c_void_p
+find_commands.restype = ctypes.c_int
+find_commands.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+free_trie = lib.free_trie
+free_trie.argtypes = [ctypes.c_void_p]
 
 
-class RESULT(ctypes.Structure):
-    _fields_ = [('found_array', ctypes.POINTER(ctypes.c_char_p)),
-                ('size', ctypes.c_int)]
+class CompiledTrie:
+    """Owns a trie that lives in C, the trie is released once this object is garbage collected.
 
+    Every string is reference counted, since many bots can share the same prefix/command. The trie in C is only
+    touched when a string is seen for the first time or when the last owner of it is gone. When reverse is True,
+    strings are stored backward which lets the C code match the end of a word instead of the start.
 
-def compile_array(string_list: List[str], /) -> Tuple[ctypes.c_char_p, int]:
-    """Converts a list of strings that are sorted into binary that will be accepted by C code."""
-    ArrString = ctypes.c_char_p * len(string_list)
-    binary_array = (x.encode('utf-8') for x in string_list)
-    array_string = ArrString(*binary_array)
-    return array_string, len(string_list)
+    C never hands back strings, each string is given an index into entries when inserted and C writes the index of
+    every match into a buffer that is allocated once per trie.
+    """
+    __slots__ = ("handle", "reverse", "entries", "buffer", "_counter", "_free_index")
+    BUFFER_SIZE = 256
+
+    def __init__(self, string_list: Iterable[str] = (), /, *, reverse: bool = False):
+        self.handle = create_trie()
+        self.reverse = reverse
+        self.entries: List[Optional[str]] = []
+        self.buffer = (ctypes.c_int * self.BUFFER_SIZE)()
+        self._counter: Dict[str, Tuple[int, int]] = {}
+        self._free_index: List[int] = []
+        for string in string_list:
+            self.add(string)
+
+    def _encode(self, string: str) -> bytes:
+        binary = string.encode("utf-8")
+        return binary[::-1] if self.reverse else binary
+
+    def add(self, string: str, /) -> bool:
+        """Adds a string to the trie. Returns True when the trie was changed."""
+        if (value := self._counter.get(string)) is not None:
+            index, count = value
+            self._counter[string] = index, count + 1
+            return False
+
+        if self._free_index:
+            index = self._free_index.pop()
+            self.entries[index] = string
+        else:
+            index = len(self.entries)
+            self.entries.append(string)
+
+        self._counter[string] = index, 1
+        trie_insert(self.handle, self._encode(string), index)
+        return True
+
+    def discard(self, string: str, /) -> bool:
+        """Removes a string from the trie. Returns True when the trie was changed."""
+        if (value := self._counter.get(string)) is None:
+            return False
+
+        index, count = value
+        if count > 1:
+            self._counter[string] = index, count - 1
+            return False
+
+        del self._counter[string]
+        trie_remove(self.handle, self._encode(string))
+        self.entries[index] = None
+        self._free_index.append(index)
+        return True
+
+    def resolve(self, indexes: Iterable[int], /) -> List[str]:
+        """Converts indexes written by C back into the strings they were inserted with."""
+        entries = self.entries
+        return [entries[i] for i in indexes]
+
+    def __contains__(self, string: str) -> bool:
+        return string in self._counter
+
+    def __len__(self) -> int:
+        return len(self._counter)
 
+    def __del__(self) -> None:
+        if self.handle:
+            free_trie(self.handle)
+            self.handle = None
 
-def decode_result(return_result: int, /) -> List[Any]:
-    """Creates a RESULT structure from address given and return a list of the address"""
-    result = RESULT.from_address(return_result)
-    to_return = [x.decode("utf-8") for x in result.found_array[:result.size]]
-    freeing(ctypes.byref(result))
-    return to_return
 
+def search_prefixes(trie: CompiledTrie, content: bytes, /) -> List[str]:
+    """Walks the content through the prefix trie in C, returning every known prefix the content starts with.
+
+    This takes microseconds for a message, which is cheaper to run inline than to hop into an executor.
+    """
+    buffer = trie.buffer
+    size = find_prefix(trie.handle, content, buffer, trie.BUFFER_SIZE)
+    return trie.resolve(buffer[:size])
 
-def actually_calls(param: Tuple[Any, Any], callback: Callable[[Any, Any, Any], int], /) -> Optional[List[Any]]:
-    """Handles C functions and return value."""
-    array_stuff, content_buffer = param
-    if array_stuff:
-        array_string, size = array_stuff
-        callback.argtypes = [ctypes.c_char_p * size, ctypes.c_char_p, ctypes.c_int]
-        return_result = callback(array_string, content_buffer, size)
-        return decode_result(return_result)
 
+def search_commands(trie: CompiledTrie, content: bytes, /) -> List[str]:
+    """Walks each word through the reversed command trie in C, returning every known command a word ends with."""
+    buffer = trie.buffer
+    size = find_commands(trie.handle, content, buffer, trie.BUFFER_SIZE)
+    return trie.resolve(buffer[:size])
 
-@in_executor()
-def search_prefixes(*args: Any) -> List[Any]:
-    """Pass multi_find_prefix function from C."""
-    return actually_calls(args, multi_find_prefix)
 
+class PrefixSearchBatch:
+    """Groups every prefix search requested within the same event loop tick into a single C call per trie.
 
-@in_executor()
-def search_commands(*args: Any) -> List[Any]:
-    """Pass find_commands function from C."""
-    return actually_calls(args, find_commands)
+    This has the same signature as search_prefixes, except it returns a future that is resolved on the next iteration
+    of the event loop. It is only worth it during message bursts, search_prefixes is cheaper otherwise.
+    """
+    def __init__(self) -> None:
+        self._pending: Dict[CompiledTrie, List[Tuple[bytes, asyncio.Future[List[str]]]]] = {}
+
+    def __call__(self, trie: CompiledTrie, content: bytes, /) -> asyncio.Future[List[str]]:
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            loop.call_soon(self.flush)
+
+        future = loop.create_future()
+        self._pending.setdefault(trie, []).append((content, future))
+        return future
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for trie, searches in pending.items():
+            size = len(searches)
+            contents = (ctypes.c_char_p * size)(*[content for content, _ in searches])
+            counts = (ctypes.c_int * size)()
+            # a content can never match more prefixes than it has bytes
+            buffer_size = sum(len(content) for content, _ in searches)
+            buffer = (ctypes.c_int * buffer_size)()
+            found = find_prefix_many(trie.handle, contents, size, counts, buffer, buffer_size)
+            iter_found = iter(trie.resolve(buffer[:found]))
+            for (_, future), count in zip(searches, counts):
+                prefixes = [*itertools.islice(iter_found, count)]
+                if not future.done():
+                    future.set_result(prefixes)
+
+
+class PrefixMatcher:
+    """A bot prefix with its case insensitive pattern compiled once."""
+    __slots__ = ("prefix", "pattern")
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.pattern = re.compile(re.escape(prefix), flags=re.I)
+
+    def match(self, content: str) -> str:
+        """Returns the prefix as it is written at the start of content, or the prefix itself when it is not there."""
+        if match := self.pattern.match(content):
+            return match[0]
+        return self.prefix
 
 
 def print_exception(text: str, error: Exception, *, _print: bool = True) -> str:
@@ -366,6 +484,17 @@ async def cancel_gen(agen: AsyncGenerator[Any, Any]) -> None:
     await agen.aclose()
 
 
+SOURCE_EXTENSIONS = ".py", ".c"
+# line counts keyed by (root, HEAD commit), a count only changes when HEAD moves. A root outside of git is keyed with
+# None and counted once for the lifetime of the process.
+_source_line_counts: Dict[Tuple[str, Optional[str]], int] = {}
+
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
 def _iterate_source_line_counts(root: str) -> Iterator[int]:
     for child in os.listdir(root):
         # ignore nasty hidden files
@@ -376,13 +505,28 @@ def _iterate_source_line_counts(root: str) -> Iterator[int]:
         if os.path.isdir(path):
             yield from _iterate_source_line_counts(path)
         else:
-            if path.endswith((".py", ".c")):
-                with open(path) as f:
-                    yield len(f.readlines())
+            if path.endswith(SOURCE_EXTENSIONS):
+                yield _count_lines(path)
 
 
 def count_source_lines(root: str) -> int:
-    return sum(_iterate_source_line_counts(root))
+    """Counts the lines of every source file tracked by git in root, cached for the current HEAD.
+    Outside of a git repository, every source file in root is counted instead, only once."""
+    from pygit2 import GitError, Repository
+
+    try:
+        repo = Repository(root)
+        key = root, str(repo.head.target)
+    except GitError:
+        if (count := _source_line_counts.get((root, None))) is None:
+            count = _source_line_counts[root, None] = sum(_iterate_source_line_counts(root))
+        return count
+
+    if (count := _source_line_counts.get(key)) is None:
+        paths = (os.path.join(repo.workdir, entry.path) for entry in repo.index)
+        sources = [path for path in paths if path.endswith(SOURCE_EXTENSIONS) and os.path.isfile(path)]
+        count = _source_line_counts[key] = sum(map(_count_lines, sources))
+    return count
 
 
 def aware_utc(dt: datetime.datetime, format: bool = True, *,